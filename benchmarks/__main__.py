@@ -0,0 +1,104 @@
+#
+# Copyright (C) 2021 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+# Runs every benchmark and optionally dumps the results as JSON so runs can
+# be compared over time:
+#
+#   python -m benchmarks [--number N] [--latency MS] [--json PATH|-]
+#                        [--cassette PATH]
+
+
+import argparse
+import datetime
+import importlib.metadata
+import json
+import platform
+import subprocess
+import sys
+
+from . import client, imports, parser
+from .common import format_results
+
+
+def _hnap_version():
+    try:
+        return importlib.metadata.version("hnap")
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    argparser = argparse.ArgumentParser(prog="python -m benchmarks")
+    argparser.add_argument("--number", type=int, default=500)
+    argparser.add_argument(
+        "--latency", type=float, default=0.0, help="Simulated device latency (ms)"
+    )
+    argparser.add_argument("--json", help="Write results as JSON ('-' for stdout)")
+    argparser.add_argument(
+        "--cassette", metavar="PATH", help="Parse responses from a recorded cassette"
+    )
+    args = argparser.parse_args()
+
+    results = parser.run(args.number, args.cassette) + client.run(
+        args.number, args.latency / 1e3
+    )
+
+    # Each sample is a new interpreter, a few are enough
+    import_results, _ = imports.run(min(args.number, 20))
+    results += import_results
+
+    if args.json != "-":
+        print(format_results(results))
+
+    if args.json:
+        data = {
+            "meta": {
+                "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "hnap": _hnap_version(),
+                "revision": _git_revision(),
+                "number": args.number,
+                "latency_ms": args.latency,
+                "cassette": args.cassette,
+            },
+            "results": results,
+        }
+        if args.json == "-":
+            json.dump(data, sys.stdout, indent=2)
+            print()
+        else:
+            with open(args.json, "w") as fh:
+                json.dump(data, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+#
+# Copyright (C) 2021 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+# Client and device benchmarks against hnap.simulator, no hardware needed.
+# Run from the repository root:
+#
+#   python -m benchmarks.client [--number N] [--latency MS]
+
+
+import argparse
+
+from hnap import DeviceFactory, SoapClient
+from hnap.capabilities import CapabilityCache
+from hnap.simulator import Simulator, VirtualMotion, VirtualSiren
+
+from .common import format_results, measure
+
+PASSWORD = "123456"
+
+
+def _client(port, **kwargs):
+    return SoapClient(
+        hostname="127.0.0.1",
+        port=port,
+        password=PASSWORD,
+        renew_margin=None,
+        **kwargs,
+    )
+
+
+def run(number, latency=0.0):
+    results = []
+
+    with Simulator() as sim:
+        motion_port = sim.add(VirtualMotion(PASSWORD, latency=latency))
+        siren_port = sim.add(VirtualSiren(PASSWORD, latency=latency))
+
+        with _client(motion_port) as client:
+            results.append(
+                measure(
+                    "client.authenticate",
+                    lambda: client.authenticate(force=True),
+                    number,
+                )
+            )
+            results.append(
+                measure(
+                    "client.call.GetLatestDetection",
+                    lambda: client.call("GetLatestDetection", ModuleID=1),
+                    number,
+                )
+            )
+            results.append(
+                measure(
+                    "client.call_raw.GetDeviceSettings",
+                    lambda: client.call_raw("GetDeviceSettings"),
+                    number,
+                )
+            )
+            results.append(
+                measure(
+                    "client.call_many.x4",
+                    lambda: client.call_many(
+                        [
+                            ("GetLatestDetection", {"ModuleID": 1}),
+                            ("GetMotionDetectorSettings", {"ModuleID": 1}),
+                        ]
+                        * 2
+                    ),
+                    number,
+                )
+            )
+
+            motion = DeviceFactory(client=client)
+            results.append(measure("motion.is_active", motion.is_active, number))
+
+        with _client(siren_port) as client:
+            siren = DeviceFactory(client=client)
+            results.append(measure("siren.is_playing", siren.is_playing, number))
+
+        # Fresh client each time: login plus device inspection
+        def _cold_factory():
+            with _client(siren_port, capability_cache=CapabilityCache()) as client:
+                DeviceFactory(client=client)
+
+        results.append(measure("device_factory.cold", _cold_factory, number))
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--number", type=int, default=500)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Simulated device latency (ms)"
+    )
+    args = parser.parse_args()
+
+    print(format_results(run(args.number, args.latency / 1e3)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+#
+# Copyright (C) 2021 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import time
+import tracemalloc
+
+
+def _percentile(samples, pct):
+    samples = sorted(samples)
+    idx = min(len(samples) - 1, round(pct / 100 * (len(samples) - 1)))
+    return samples[idx]
+
+
+def measure(name, fn, number, alloc_number=None):
+    samples = []
+    for _ in range(number):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+
+    # Allocation tracing slows things down, keep it out of timings
+    alloc_number = alloc_number or min(number, 100)
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        for _ in range(alloc_number):
+            fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return summarize(name, samples, (peak - before) / 1024)
+
+
+def summarize(name, samples, peak_alloc_kib=None):
+    total = sum(samples)
+    return {
+        "name": name,
+        "number": len(samples),
+        "calls_per_sec": len(samples) / total if total else None,
+        "mean_ms": total / len(samples) * 1e3,
+        "p50_ms": _percentile(samples, 50) * 1e3,
+        "p99_ms": _percentile(samples, 99) * 1e3,
+        "peak_alloc_kib": peak_alloc_kib,
+    }
+
+
+def _format(value, spec):
+    return "-" if value is None else format(value, spec)
+
+
+def format_results(results):
+    row = "{:<40} {:>10} {:>10} {:>10} {:>10} {:>12}"
+    lines = [
+        row.format("benchmark", "calls/s", "mean ms", "p50 ms", "p99 ms", "alloc KiB")
+    ]
+    for r in results:
+        lines.append(
+            row.format(
+                r["name"],
+                _format(r["calls_per_sec"], ".0f"),
+                _format(r["mean_ms"], ".3f"),
+                _format(r["p50_ms"], ".3f"),
+                _format(r["p99_ms"], ".3f"),
+                _format(r["peak_alloc_kib"], ".1f"),
+            )
+        )
+
+    return "\n".join(lines)
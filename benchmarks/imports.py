@@ -0,0 +1,128 @@
+#
+# Copyright (C) 2021 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+# Import time regression check for the library and the CLI. Exits with
+# status 1 if any scenario loads one of the HEAVY modules or, with --max-ms,
+# takes longer than that on top of a bare interpreter start:
+#
+#   python -m benchmarks.imports [--number N] [--max-ms MS]
+
+
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+from .common import format_results, summarize
+
+# Must not be loaded until a client is actually used
+HEAVY = [
+    "aiohttp",
+    "asyncio",
+    "hnap.devices",
+    "hnap.soapclient",
+    "requests",
+    "sqlite3",
+    "xml.dom.minidom",
+    "xmltodict",
+]
+
+REPORT = f"""
+import json, sys
+print(json.dumps([m for m in {HEAVY!r} if m in sys.modules]))
+"""
+
+SCENARIOS = {
+    "baseline": "",
+    "import hnap": "import hnap",
+    "hnap --help": """
+import contextlib, io, sys
+sys.argv = ["hnap", "--help"]
+from hnap.cli import main
+with contextlib.redirect_stdout(io.StringIO()):
+    try:
+        main()
+    except SystemExit:
+        pass
+""",
+}
+
+
+def _run(code):
+    started = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-c", code + REPORT],
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+    elapsed = time.perf_counter() - started
+
+    return elapsed, json.loads(proc.stdout.splitlines()[-1])
+
+
+def run(number):
+    results = []
+    loaded = {}
+
+    for name, code in SCENARIOS.items():
+        samples = []
+        for _ in range(number):
+            elapsed, loaded[name] = _run(code)
+            samples.append(elapsed)
+
+        results.append(summarize(f"imports.{name}", samples))
+
+    return results, loaded
+
+
+def check(results, loaded, max_ms=None):
+    problems = []
+    baseline = results[0]["p50_ms"]
+
+    for result, (name, modules) in zip(results[1:], list(loaded.items())[1:]):
+        if modules:
+            problems.append(f"{name}: loads {', '.join(modules)}")
+
+        overhead = result["p50_ms"] - baseline
+        if max_ms is not None and overhead > max_ms:
+            problems.append(f"{name}: {overhead:.1f}ms over baseline (max {max_ms}ms)")
+
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--number", type=int, default=20)
+    parser.add_argument("--max-ms", type=float)
+    args = parser.parse_args()
+
+    results, loaded = run(args.number)
+    print(format_results(results))
+
+    problems = check(results, loaded, args.max_ms)
+    for problem in problems:
+        print(problem, file=sys.stderr)
+
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
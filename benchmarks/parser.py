@@ -0,0 +1,124 @@
+#
+# Copyright (C) 2021 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+# Compares hnap.parser against the xmltodict/minidom based decoding it
+# replaced. Run from the repository root:
+#
+#   python -m benchmarks.parser [--number N] [--cassette PATH]
+#
+# --cassette benchmarks the responses in a cassette recorded with
+# hnap.cassette.record instead of the bundled ones.
+
+
+import argparse
+import pathlib
+import xml.dom.minidom
+
+import xmltodict
+
+from hnap.cassette import load_cassette
+from hnap.parser import parse_response
+from hnap.soapclient import BaseSoapClient
+
+from .common import format_results, measure
+
+RESPONSES_DIR = pathlib.Path(__file__).parent / "responses"
+
+# Fields actually read by the library for each captured response
+FIELDS = {
+    "GetLatestDetection": ["LatestDetectTime"],
+    "GetMotionDetectorSettings": ["Backoff"],
+    "GetSirenAlarmSettings": ["IsSounding"],
+    "Login": ["Challenge", "PublicKey", "Cookie"],
+}
+
+
+def load_responses(cassette=None):
+    if cassette is None:
+        return {
+            path.stem: path.read_bytes() for path in sorted(RESPONSES_DIR.glob("*.xml"))
+        }
+
+    # First successful response for each method, the challenge for Login
+    ret = {}
+    for interaction in load_cassette(cassette):
+        action = interaction["action"]
+        if interaction["status"] == 200 and action.startswith(
+            BaseSoapClient.HNAP1_XMLNS
+        ):
+            method = action[len(BaseSoapClient.HNAP1_XMLNS) :]
+            ret.setdefault(method, interaction["response"].encode("utf-8"))
+
+    return dict(sorted(ret.items()))
+
+
+def legacy_parse(body, method):
+    if method == "Login":
+        doc = xml.dom.minidom.parseString(body)
+        return {
+            tag: doc.getElementsByTagName(tag)[0].firstChild.nodeValue
+            for tag in ["LoginResult", *FIELDS["Login"]]
+        }
+
+    parsed = xmltodict.parse(body.decode("utf-8"))
+    return parsed["soap:Envelope"]["soap:Body"][f"{method}Response"]
+
+
+def run(number, cassette=None):
+    results = []
+
+    for method, body in load_responses(cassette).items():
+        if method != "Login":
+            assert legacy_parse(body, method) == parse_response(body, method)
+
+        fields = FIELDS.get(method, [])
+        results.extend(
+            [
+                measure(
+                    f"parser.legacy.{method}",
+                    lambda: legacy_parse(body, method),
+                    number,
+                ),
+                measure(
+                    f"parser.full.{method}",
+                    lambda: parse_response(body, method),
+                    number,
+                ),
+                measure(
+                    f"parser.fields.{method}",
+                    lambda: parse_response(body, method, fields=fields),
+                    number,
+                ),
+            ]
+        )
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--number", type=int, default=2000)
+    parser.add_argument("--cassette", metavar="PATH")
+    args = parser.parse_args()
+
+    print(format_results(run(args.number, args.cassette)))
+
+
+if __name__ == "__main__":
+    main()
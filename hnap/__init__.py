@@ -16,28 +16,88 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
 # USA.
 
-from .devices import (
-    Camera,
-    Device,
-    DeviceFactory,
-    Motion,
-    Router,
-    Siren,
-    SirenSound,
-    Water,
-)
-from .soapclient import AuthenticationError, MethodCallError, SoapClient
-
-__all__ = [
-    "AuthenticationError",
-    "MethodCallError",
-    "Device",
-    "DeviceFactory",
-    "Camera",
-    "Motion",
-    "Router",
-    "Siren",
-    "SirenSound",
-    "SoapClient",
-    "Water",
-]
+
+import importlib
+
+# Submodules are imported on first access, "import hnap" (and the CLI) must
+# not pay for requests and friends until they are actually needed.
+_EXPORTS = {
+    "AdaptiveTimeouts": "timeouts",
+    "AuthenticationError": "soapclient",
+    "CircuitBreaker": "resilience",
+    "CircuitOpenError": "soapclient",
+    "InvalidSessionError": "soapclient",
+    "MethodCallError": "soapclient",
+    "Device": "devices",
+    "discover": "discovery",
+    "async_discover": "discovery",
+    "DeviceFactory": "devices",
+    "DeviceInfo": "models",
+    "DiscoveredDevice": "discovery",
+    "Camera": "devices",
+    "ClientEvent": "devices",
+    "ClientEventType": "devices",
+    "Instrumentation": "metrics",
+    "Metrics": "metrics",
+    "ModuleActions": "models",
+    "Motion": "devices",
+    "MotionEvent": "devices",
+    "MotionEventType": "devices",
+    "MotionState": "models",
+    "Retry": "resilience",
+    "Router": "devices",
+    "RouterClient": "models",
+    "Scheduler": "scheduler",
+    "Siren": "devices",
+    "SirenState": "models",
+    "SirenSound": "devices",
+    "Snapshot": "models",
+    "SoapClient": "soapclient",
+    "Timeouts": "timeouts",
+    "Water": "devices",
+    "WaterState": "models",
+}
+
+# Eager imports used to bind these as attributes, "hnap.devices.Motion"
+# keeps working
+_SUBMODULES = {
+    "asyncdevices",
+    "asyncsoapclient",
+    "capabilities",
+    "cassette",
+    "cli",
+    "const",
+    "devices",
+    "discovery",
+    "helpers",
+    "metrics",
+    "models",
+    "parser",
+    "resilience",
+    "scheduler",
+    "sessionstore",
+    "simulator",
+    "singleflight",
+    "soapclient",
+    "timeouts",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module(f".{name}", __name__)
+
+    try:
+        module = _EXPORTS[name]
+    except KeyError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
+
+    value = getattr(importlib.import_module(f".{module}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
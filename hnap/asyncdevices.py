@@ -0,0 +1,312 @@
+#
+# Copyright (C) 2021 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import asyncio
+import logging
+
+import aiohttp
+
+from .asyncsoapclient import AsyncSoapClient
+from .const import (
+    DEFAULT_MODULE_ID,
+    DEFAULT_MOTION_BACKOFF,
+    DEFAULT_PORT,
+    DEFAULT_SNAPSHOT_CONCURRENCY,
+    DEFAULT_USERNAME,
+    DEFAULT_WATCH_MIN_INTERVAL,
+)
+from .devices import (
+    Camera,
+    Motion,
+    Siren,
+    SirenSound,
+    _camera_base_url,
+    _check_ok_result,
+    _ClientTracker,
+    _device_class_for,
+    _is_within_backoff,
+    _iter_client_elements,
+    _iter_client_records,
+    _MotionWatcher,
+    _parse_backoff,
+    _parse_clients,
+    _parse_latest_detection,
+    _snapshot_methods,
+)
+from .helpers import async_auth_required
+from .models import (
+    DeviceInfo,
+    ModuleActions,
+    MotionState,
+    RouterClient,
+    SirenState,
+    Snapshot,
+    WaterState,
+)
+from .soapclient import ClientError
+
+_LOGGER = logging.getLogger(__name__)
+
+
+async def AsyncDeviceFactory(
+    *,
+    client=None,
+    hostname=None,
+    password=None,
+    username=DEFAULT_USERNAME,
+    port=DEFAULT_PORT,
+):
+    client = client or AsyncSoapClient(
+        hostname=hostname, password=password, username=username, port=port
+    )
+    info = await client.device_info()
+    cls = _device_class_for(
+        info,
+        [
+            (AsyncSiren.MODULE_TYPE, AsyncSiren),
+            (AsyncCamera.MODULE_TYPE, AsyncCamera),
+            (AsyncMotion.MODULE_TYPE, AsyncMotion),
+        ],
+    )
+
+    return cls(client=client)
+
+
+class AsyncDevice:
+    MODULE_TYPE: str
+
+    def __init__(
+        self,
+        *,
+        client=None,
+        hostname=None,
+        password=None,
+        username=DEFAULT_USERNAME,
+        port=DEFAULT_PORT,
+        module_id=DEFAULT_MODULE_ID,
+    ):
+        self.client = client or AsyncSoapClient(
+            hostname=hostname, password=password, username=username, port=port
+        )
+        self.module_id = module_id
+
+        self._info = None
+        self._device_info = None
+
+    async def get_info(self):
+        if not self._info:
+            self._info = await self.client.device_info()
+
+        return self._info
+
+    async def get_device_info(self):
+        if self._device_info is None:
+            self._device_info = DeviceInfo.from_response(
+                await self.get_info(), await self.client.device_actions()
+            )
+
+        return self._device_info
+
+    async def get_module_actions(self):
+        return ModuleActions.from_response(
+            await self.client.module_actions(ModuleID=self.module_id), self.module_id
+        )
+
+    async def call(self, *args, **kwargs):
+        kwargs["ModuleID"] = self.module_id
+        return await self.client.call(*args, **kwargs)
+
+    async def call_many(self, calls):
+        return await self.client.call_many(
+            (method, dict(parameters, ModuleID=self.module_id))
+            for (method, parameters) in calls
+        )
+
+    @async_auth_required
+    async def snapshot(self, actions=None, concurrency=DEFAULT_SNAPSHOT_CONCURRENCY):
+        info = await self.get_device_info()
+        module_actions = await self.get_module_actions()
+        methods = (
+            _snapshot_methods(module_actions) if actions is None else list(actions)
+        )
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def _fetch(method):
+            async with semaphore:
+                try:
+                    return await self.call(method)
+                except ClientError as e:
+                    return e
+
+        responses = await asyncio.gather(*(_fetch(x) for x in methods))
+        return Snapshot.from_responses(info, module_actions, zip(methods, responses))
+
+    def is_authenticated(self):
+        return self.client.is_authenticated()
+
+    async def authenticate(self):
+        return await self.client.authenticate()
+
+
+class AsyncCamera(AsyncDevice):
+    MODULE_TYPE = Camera.MODULE_TYPE
+    DEFAULT_SCHEMA = Camera.DEFAULT_SCHEMA
+    DEFAULT_STREAM_PATH = Camera.DEFAULT_STREAM_PATH
+    DEFAULT_PICTURE_PATH = Camera.DEFAULT_PICTURE_PATH
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._base_url = _camera_base_url(self.client, self.DEFAULT_SCHEMA)
+
+    @property
+    def stream_url(self):
+        return f"{self._base_url}{self.DEFAULT_STREAM_PATH}"
+
+    @property
+    def picture_url(self):
+        return f"{self._base_url}{self.DEFAULT_PICTURE_PATH}"
+
+
+class AsyncMotion(AsyncDevice):
+    MODULE_TYPE = Motion.MODULE_TYPE
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._backoff = None
+
+    async def get_backoff(self):
+        if self._backoff is None:
+            self._backoff = _parse_backoff(await self.call("GetMotionDetectorSettings"))
+            if self._backoff is None:
+                # Return the default value for tested devices but don't store
+                # to force retry
+                return DEFAULT_MOTION_BACKOFF
+
+        return self._backoff
+
+    @async_auth_required
+    async def get_latest_detection(self):
+        return _parse_latest_detection(await self.call("GetLatestDetection"))
+
+    @async_auth_required
+    async def get_state(self):
+        return MotionState.from_response(
+            await self.call("GetLatestDetection"), await self.get_backoff()
+        )
+
+    @async_auth_required
+    async def is_active(self):
+        return _is_within_backoff(
+            await self.get_latest_detection(), await self.get_backoff()
+        )
+
+    async def watch(self, min_interval=DEFAULT_WATCH_MIN_INTERVAL, max_interval=None):
+        watcher = _MotionWatcher(min_interval, max_interval)
+
+        while True:
+            try:
+                events = watcher.update(
+                    await self.get_latest_detection(), await self.get_backoff()
+                )
+
+            except (ClientError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                _LOGGER.warning(f"{self.client.hostname}: unable to poll: {e}")
+                events = []
+
+            for event in events:
+                yield event
+
+            await asyncio.sleep(watcher.delay())
+
+
+class AsyncRouter(AsyncDevice):
+    # NOT tested
+    MODULE_TYPE = "check-module-types-for-router"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._tracker = _ClientTracker()
+
+    @property
+    def known_clients(self):
+        return dict(self._tracker.clients)
+
+    @async_auth_required
+    async def get_clients(self):
+        return _parse_clients(await self.call("GetClientInfo"))
+
+    @async_auth_required
+    async def poll_clients(self):
+        body = await self.client.call_raw("GetClientInfo", ModuleID=self.module_id)
+        return self._tracker.update(_iter_client_records(body))
+
+    @async_auth_required
+    async def get_client_list(self):
+        body = await self.client.call_raw("GetClientInfo", ModuleID=self.module_id)
+        return [
+            RouterClient.from_element(x)
+            for x in _iter_client_elements(body, RouterClient.FIELDS)
+        ]
+
+
+class AsyncSiren(AsyncDevice):
+    MODULE_TYPE = Siren.MODULE_TYPE
+
+    @async_auth_required
+    async def is_playing(self):
+        res = await self.call("GetSirenAlarmSettings")
+        return res["IsSounding"] == "true"
+
+    @async_auth_required
+    async def get_state(self):
+        return SirenState.from_response(await self.call("GetSirenAlarmSettings"))
+
+    @async_auth_required
+    async def play(self, sound=SirenSound.EMERGENCY, volume=100, duration=60):
+        ret = await self.call(
+            "SetSoundPlay",
+            SoundType=sound.value,
+            Volume=volume,
+            Duration=duration,
+        )
+        _check_ok_result(ret, "SetSoundPlay", "Unable to play")
+
+    @async_auth_required
+    async def beep(self, volume=100, duration=1):
+        return await self.play(sound=SirenSound.BEEP, duration=duration, volume=volume)
+
+    @async_auth_required
+    async def stop(self):
+        ret = await self.call("SetAlarmDismissed")
+        _check_ok_result(ret, "SetAlarmDismissed", "Unable to stop")
+
+
+class AsyncWater(AsyncDevice):
+    # NOT tested
+    MODULE_TYPE = "check-module-types-for-water-detector"
+
+    @async_auth_required
+    async def is_active(self):
+        ret = await self.call("GetWaterDetectorState")
+        return ret.get("IsWater") == "true"
+
+    @async_auth_required
+    async def get_state(self):
+        return WaterState.from_response(await self.call("GetWaterDetectorState"))
@@ -0,0 +1,460 @@
+#
+# Copyright (C) 2021 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import asyncio
+import logging
+import time
+
+import aiohttp
+
+from .const import (
+    DEFAULT_MODULE_ID,
+    DEFAULT_POOL_IDLE_TIMEOUT,
+    DEFAULT_POOL_SIZE,
+    DEFAULT_PORT,
+    DEFAULT_REQUEST_TIMEOUT,
+    DEFAULT_SESSION_LIFETIME,
+    DEFAULT_SESSION_RENEW_MARGIN,
+    DEFAULT_USERNAME,
+)
+from .helpers import async_auth_required
+from .singleflight import AsyncSingleFlight
+from .soapclient import (
+    AuthenticationError,
+    BaseSoapClient,
+    ClientError,
+    InvalidSessionError,
+    MethodCallError,
+    _is_read_only,
+)
+
+_LOGGER = logging.getLogger(__name__)
+_SINGLE_FLIGHT = AsyncSingleFlight()
+
+
+class AsyncSoapClient(BaseSoapClient):
+    def __init__(
+        self,
+        hostname,
+        password,
+        username=DEFAULT_USERNAME,
+        port=DEFAULT_PORT,
+        request_timeout=DEFAULT_REQUEST_TIMEOUT,
+        session_lifetime=DEFAULT_SESSION_LIFETIME,
+        session=None,
+        pool_size=DEFAULT_POOL_SIZE,
+        pool_idle_timeout=DEFAULT_POOL_IDLE_TIMEOUT,
+        session_store=None,
+        renew_margin=DEFAULT_SESSION_RENEW_MARGIN,
+        capability_cache=None,
+        coalesce=True,
+        metrics=None,
+        circuit_breaker=None,
+        retry=None,
+        timeouts=None,
+    ):
+        self._renew_handle = None
+        self._renew_task = None
+
+        super().__init__(
+            hostname,
+            password,
+            username=username,
+            port=port,
+            request_timeout=request_timeout,
+            session_lifetime=session_lifetime,
+            session_store=session_store,
+            renew_margin=renew_margin,
+            capability_cache=capability_cache,
+            coalesce=coalesce,
+            metrics=metrics,
+            circuit_breaker=circuit_breaker,
+            retry=retry,
+            timeouts=timeouts,
+        )
+
+        # aiohttp sessions must be created from a running loop, the owned one
+        # is built lazily on the first request
+        self._owns_session = session is None
+        self._session = session
+        self._pool_size = pool_size
+        self._pool_idle_timeout = pool_idle_timeout
+        self._last_request = 0.0
+        self._auth_lock = asyncio.Lock()
+
+        self._restore_session()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    @property
+    def session(self):
+        return self._session
+
+    def _build_session(self):
+        connector = aiohttp.TCPConnector(
+            limit_per_host=self._pool_size,
+            keepalive_timeout=self._pool_idle_timeout,
+        )
+        return aiohttp.ClientSession(connector=connector)
+
+    async def _request(self, method, data, headers):
+        # The breaker sees one outcome per logical request, retries included
+        breaker = self._circuit_breaker
+        probe = breaker is not None and breaker.acquire()
+        timeout = self._request_timeouts(method, probe)
+
+        success = False
+        try:
+            ret = await self._request_with_retry(method, data, headers, timeout, probe)
+            success = ret[0] < 500
+            return ret
+
+        finally:
+            if breaker is not None:
+                breaker.record(success, probe)
+
+    async def _request_with_retry(self, method, data, headers, timeout, probe=False):
+        if self._retry is None or probe:
+            return await self._timed_request(method, data, headers, timeout)
+
+        delays = self._retry.delays()
+        while True:
+            try:
+                return await self._timed_request(method, data, headers, timeout)
+
+            except aiohttp.ClientConnectionError as e:
+                delay = next(delays, None)
+                if delay is None or not self._is_retryable(method, e):
+                    raise
+
+                _LOGGER.debug(f"{self.hostname}: {e}, retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+    def _is_retryable(self, method, error):
+        # ServerTimeoutError is a ClientConnectionError too, timeouts are
+        # never retried
+        if isinstance(error, asyncio.TimeoutError):
+            return False
+
+        # Connection refused, unreachable host, name resolution... the
+        # request never left. Otherwise it may have reached the device.
+        return isinstance(error, aiohttp.ClientConnectorError) or _is_read_only(method)
+
+    async def _timed_request(self, method, data, headers, timeout):
+        started = time.perf_counter()
+        try:
+            ret = await self._send(method, data, headers, timeout)
+
+        except asyncio.TimeoutError:
+            self._timeouts.timed_out(method)
+            raise
+
+        self._timeouts.observe(method, time.perf_counter() - started)
+        return ret
+
+    async def _send(self, method, data, headers, timeout):
+        if self._session is None:
+            self._session = self._build_session()
+
+        reused = self._last_request > 0
+
+        async def _do_request():
+            async with self._session.request(
+                method=self.HNAP_METHOD,
+                url=self.HNAP_AUTH["url"],
+                headers=headers,
+                data=data,
+                timeout=aiohttp.ClientTimeout(
+                    sock_connect=timeout[0], sock_read=timeout[1]
+                ),
+            ) as resp:
+                return resp.status, await resp.read()
+
+        try:
+            ret = await _do_request()
+
+        except (aiohttp.ServerDisconnectedError, aiohttp.ClientOSError) as e:
+            # A refused connection (ClientConnectorError is a ClientOSError
+            # too) is not a stale one. The request may have reached the device
+            # before the connection was closed, only send it again if that's
+            # harmless.
+            if (
+                not reused
+                or isinstance(e, aiohttp.ClientConnectorError)
+                or not self._is_retryable(method, e)
+            ):
+                raise
+
+            # Device closed a kept-alive connection under our feet, retry
+            # once with a fresh one
+            _LOGGER.debug(f"{self.hostname}: stale connection, reconnecting")
+            self._connection_used("stale")
+            reused = False
+            ret = await _do_request()
+
+        self._connection_used("reused" if reused else "new")
+        self._last_request = time.monotonic()
+        return ret
+
+    async def close(self):
+        if self._owns_session and self._session is not None:
+            await self._session.close()
+            self._session = None
+
+        if self._renew_handle is not None:
+            self._renew_handle.cancel()
+            self._renew_handle = None
+
+        self._last_request = 0.0
+
+    async def _call_request(self, method, parameters, auth=None):
+        data, headers = self._build_call_request(method, parameters, auth=auth)
+
+        if self._metrics is None:
+            status, body = await self._request(method, data, headers)
+        else:
+            started = time.perf_counter()
+            status, body = await self._request(method, data, headers)
+            self._metrics.phase(self, method, "http", time.perf_counter() - started)
+            self._metrics.transferred(self, method, len(data), len(body))
+
+        if status in self.HNAP_INVALID_SESSION_STATUS_CODES:
+            raise InvalidSessionError(f"Invalid status code: {status}", status)
+
+        if status != 200:
+            raise MethodCallError(f"Invalid status code: {status}", status)
+
+        return body
+
+    async def _call(self, method, parameters, auth=None):
+        return self._parse_call_response(
+            method, await self._call_request(method, parameters, auth=auth)
+        )
+
+    async def _call_with_reauth(self, fn, method, parameters):
+        self._used_since_login = True
+        auth = self.HNAP_AUTH
+
+        try:
+            ret = await fn(method, parameters, auth=auth)
+
+        except MethodCallError as e:
+            # Restored sessions are not trusted until the first successful call
+            if not self._session_restored and not isinstance(e, InvalidSessionError):
+                raise
+
+            _LOGGER.debug(f"{self.hostname}: session rejected ({e})")
+            await self._reauthenticate(auth)
+            return await fn(method, parameters)
+
+        self._session_restored = False
+        return ret
+
+    async def _call_with_metrics(self, fn, method, parameters):
+        metrics = self._metrics
+        if metrics is None:
+            return await self._call_with_reauth(fn, method, parameters)
+
+        metrics.call_started(self, method)
+        started = time.perf_counter()
+        error = None
+        try:
+            return await self._call_with_reauth(fn, method, parameters)
+
+        except Exception as e:
+            error = e
+            raise
+
+        finally:
+            metrics.call_finished(self, method, time.perf_counter() - started, error)
+
+    async def call_raw(self, method, **parameters):
+        body = await self._call_with_metrics(self._call_request, method, parameters)
+        return body.decode("utf-8", errors="replace")
+
+    async def call(self, method, **parameters):
+        key = self._coalesce_key(method, parameters)
+        if key is None:
+            return await self._call_with_metrics(self._call, method, parameters)
+
+        # Identical concurrent calls share the request, each caller gets its
+        # own copy of the result
+        return await _SINGLE_FLIGHT.do(
+            key, lambda: self._call_with_metrics(self._call, method, parameters)
+        )
+
+    @async_auth_required
+    async def call_many(self, calls):
+        # Requests run back to back over the same kept-alive connection.
+        # Method errors are returned in place, transport errors are assigned
+        # to the remaining calls too: there is no point on waiting for a
+        # timeout on each one.
+        calls = list(calls)
+        ret = []
+
+        for idx, (method, parameters) in enumerate(calls):
+            try:
+                ret.append(await self.call(method, **parameters))
+
+            except ClientError as e:
+                ret.append(e)
+
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                ret.extend([e] * (len(calls) - idx))
+                break
+
+        return ret
+
+    async def authenticate(self, force=False):
+        if self.is_authenticated() and not force:
+            _LOGGER.debug("Client already authenticated")
+            return
+
+        # Coroutines waiting here reuse the session obtained by the first one
+        auth = self.HNAP_AUTH
+        async with self._auth_lock:
+            if self.is_authenticated() and (not force or self.HNAP_AUTH is not auth):
+                return
+
+            await self._login("renewal" if self._authenticated else "login")
+
+    async def _reauthenticate(self, stale_auth):
+        async with self._auth_lock:
+            # Session was replaced while the request was in flight
+            if self.HNAP_AUTH is not stale_auth:
+                return
+
+            self._forget_session()
+            await self._login("relogin")
+
+    async def _login(self, reason):
+        metrics = self._metrics
+        if metrics is None:
+            return await self._do_login()
+
+        started = time.perf_counter()
+        error = None
+        try:
+            await self._do_login()
+
+        except Exception as e:
+            error = e
+            raise
+
+        finally:
+            metrics.login(self, reason, time.perf_counter() - started, error)
+
+    async def _do_login(self):
+        data, headers = self._build_login_request()
+        status, body = await self._request(self.HNAP_LOGIN_METHOD, data, headers)
+
+        if status != 200:
+            raise AuthenticationError(
+                f"Invalid response while login: {status} ({body!r})"
+            )
+
+        # Build the new session aside and swap it when complete, requests
+        # in flight keep using the old one
+        auth = self.HNAP_AUTH.copy()
+        self._save_login_result(body, auth)
+
+        # Phase 2
+        res = await self._call(
+            self.HNAP_LOGIN_METHOD, self._build_login_parameters(auth), auth=auth
+        )
+        self._check_login_response(res)
+
+        self.HNAP_AUTH = auth
+        self._authenticated = time.monotonic()
+        self._used_since_login = False
+        self._persist_session()
+        self._schedule_renewal()
+
+    def _schedule_renewal(self):
+        if self._renew_margin is None:
+            return
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+
+        if self._renew_handle is not None:
+            self._renew_handle.cancel()
+
+        self._renew_handle = loop.call_later(
+            self._renewal_delay(), self._start_renewal, self._authenticated
+        )
+
+    def _start_renewal(self, authenticated):
+        self._renew_handle = None
+        if self._needs_renewal(authenticated):
+            self._renew_task = asyncio.ensure_future(self._renew_session())
+
+    async def _renew_session(self):
+        _LOGGER.debug(f"{self.hostname}: renewing session")
+        try:
+            await self.authenticate(force=True)
+        except (ClientError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            _LOGGER.warning(f"{self.hostname}: unable to renew session: {e}")
+
+    @async_auth_required
+    async def _fetch_device_settings(self, **kwargs):
+        return self._parse_device_settings(
+            await self.call("GetDeviceSettings", **kwargs)
+        )
+
+    async def _inspect_device(self, **kwargs):
+        if kwargs:
+            return await self._fetch_device_settings(**kwargs)
+
+        info = self._capabilities.get_settings(self._capability_key)
+        if info is None:
+            info = await self._fetch_device_settings()
+            self._capabilities.set_settings(self._capability_key, info)
+
+        return info
+
+    async def device_info(self, **kwargs):
+        return self._device_info_from_settings(await self._inspect_device(**kwargs))
+
+    async def device_actions(self, **kwargs):
+        return self._device_actions_from_settings(await self._inspect_device(**kwargs))
+
+    @async_auth_required
+    async def _fetch_module_actions(self, **kwargs):
+        resp = await self.call("GetModuleSOAPActions", **kwargs)
+        return self._parse_module_actions(resp)
+
+    async def module_actions(self, *, ModuleID=DEFAULT_MODULE_ID, **kwargs):
+        if kwargs:
+            return await self._fetch_module_actions(ModuleID=ModuleID, **kwargs)
+
+        actions = self._capabilities.get_module_actions(self._capability_key, ModuleID)
+        if actions is None:
+            actions = await self._fetch_module_actions(ModuleID=ModuleID)
+            self._capabilities.set_module_actions(
+                self._capability_key, ModuleID, actions
+            )
+
+        return actions
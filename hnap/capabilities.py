@@ -0,0 +1,136 @@
+#
+# Copyright (C) 2021 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import copy
+import json
+import logging
+import os
+import pathlib
+import tempfile
+import threading
+import time
+
+from .const import DEFAULT_CAPABILITY_TTL
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def capability_key(hostname, port):
+    return f"{hostname}:{port}"
+
+
+class CapabilityCache:
+    # Caches GetDeviceSettings and GetModuleSOAPActions results per host.
+    # Module actions are only valid for the model and firmware they were
+    # read from and are dropped when fresh settings report a different one.
+
+    def __init__(self, ttl=DEFAULT_CAPABILITY_TTL, path=None):
+        self._ttl = ttl
+        self._path = pathlib.Path(path) if path else None
+        self._entries = {}
+        self._lock = threading.Lock()
+
+        if self._path:
+            self.load()
+
+    @property
+    def path(self):
+        return self._path
+
+    def _is_fresh(self, updated):
+        return (time.time() - updated) <= self._ttl
+
+    def get_settings(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if not entry or not self._is_fresh(entry["updated"]):
+                return None
+
+            return copy.deepcopy(entry["settings"])
+
+    def set_settings(self, key, settings):
+        identity = [settings.get("ModelName"), settings.get("FirmwareVersion")]
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if not entry or entry["identity"] != identity:
+                entry = self._entries[key] = {"identity": identity, "modules": {}}
+
+            entry["settings"] = copy.deepcopy(settings)
+            entry["updated"] = time.time()
+
+    def get_module_actions(self, key, module_id):
+        with self._lock:
+            entry = self._entries.get(key)
+            if not entry or "settings" not in entry:
+                return None
+
+            module = entry["modules"].get(str(module_id))
+            if not module or not self._is_fresh(module["updated"]):
+                return None
+
+            return copy.deepcopy(module["actions"])
+
+    def set_module_actions(self, key, module_id, actions):
+        with self._lock:
+            entry = self._entries.get(key)
+            # Actions without known settings can't be tied to a firmware
+            if not entry or "settings" not in entry:
+                return
+
+            entry["modules"][str(module_id)] = {
+                "actions": copy.deepcopy(actions),
+                "updated": time.time(),
+            }
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def load(self):
+        try:
+            entries = json.loads(self._path.read_text())
+
+        except FileNotFoundError:
+            return
+
+        except (OSError, ValueError) as e:
+            _LOGGER.warning(f"Unable to load capability cache {self._path}: {e}")
+            return
+
+        with self._lock:
+            self._entries.update(entries)
+
+    def save(self):
+        with self._lock:
+            data = json.dumps(self._entries)
+
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self._path.parent, prefix=".hnap-")
+        try:
+            with os.fdopen(fd, "w") as fh:
+                fh.write(data)
+            os.replace(tmp, self._path)
+
+        except BaseException:
+            os.unlink(tmp)
+            raise
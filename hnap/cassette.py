@@ -0,0 +1,212 @@
+#
+# Copyright (C) 2021 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+# Record and replay of SoapClient traffic. Cassettes are JSON lines files,
+# gzipped if the name ends with .gz, one request/response pair per line.
+# Login passwords and session cookies are redacted, the device password is
+# not needed to replay them. Don't combine replay with a session store: the
+# replayed (redacted) session would be persisted.
+#
+#   with record(client, "dch-s150.jsonl.gz"):
+#       client.call_raw("GetDeviceSettings")
+#
+#   with replay(client, "dch-s150.jsonl.gz", speed=None):
+#       client.call_raw("GetDeviceSettings")
+
+
+import collections
+import contextlib
+import datetime
+import gzip
+import json
+import logging
+import pathlib
+import re
+import threading
+import time
+
+import requests
+import requests.adapters
+import requests.structures
+
+_LOGGER = logging.getLogger(__name__)
+
+REDACTED = "REDACTED"
+
+_REDACT_RE = re.compile(rb"<(LoginPassword|Cookie)>[^<]+</\1>")
+
+
+class CassetteError(Exception):
+    pass
+
+
+def _redact(body):
+    return _REDACT_RE.sub(rb"<\1>" + REDACTED.encode("ascii") + rb"</\1>", body or b"")
+
+
+def _open(path, mode):
+    path = pathlib.Path(path)
+    if path.suffix == ".gz":
+        return gzip.open(path, mode + "t", encoding="utf-8")
+
+    return open(path, mode, encoding="utf-8")
+
+
+def load_cassette(path):
+    try:
+        with _open(path, "r") as fh:
+            return [json.loads(line) for line in fh if line.strip()]
+
+    except (OSError, ValueError) as e:
+        raise CassetteError(f"{path}: unable to load cassette: {e}") from e
+
+
+def save_cassette(path, interactions):
+    try:
+        with _open(path, "w") as fh:
+            for interaction in interactions:
+                fh.write(json.dumps(interaction, separators=(",", ":")) + "\n")
+
+    except OSError as e:
+        raise CassetteError(f"{path}: unable to save cassette: {e}") from e
+
+
+def _soap_action(headers):
+    return headers.get("SOAPAction", "").strip('"')
+
+
+class RecordingAdapter(requests.adapters.HTTPAdapter):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.interactions = []
+        self._lock = threading.Lock()
+
+    def send(self, request, **kwargs):
+        started = time.perf_counter()
+        resp = super().send(request, **kwargs)
+        content = resp.content
+        elapsed = time.perf_counter() - started
+
+        body = request.body
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+
+        interaction = {
+            "action": _soap_action(request.headers),
+            "request": _redact(body).decode("utf-8", errors="replace"),
+            "status": resp.status_code,
+            "response": _redact(content).decode("utf-8", errors="replace"),
+            "elapsed": round(elapsed, 6),
+        }
+        with self._lock:
+            self.interactions.append(interaction)
+
+        return resp
+
+
+class ReplayAdapter(requests.adapters.BaseAdapter):
+    # Requests are matched by SOAP action and (redacted) body, in recorded
+    # order. Once all the matching responses have been served they are
+    # served again from the first one, unless loop is False. speed scales
+    # recorded response times, None replays without waiting.
+
+    def __init__(self, interactions, speed=None, loop=True):
+        super().__init__()
+        self.speed = speed
+        self.loop = loop
+
+        self._interactions = collections.defaultdict(list)
+        for interaction in interactions:
+            key = (interaction["action"], interaction["request"])
+            self._interactions[key].append(interaction)
+
+        self._served = collections.Counter()
+        self._lock = threading.Lock()
+
+    def _next_interaction(self, key):
+        with self._lock:
+            candidates = self._interactions.get(key)
+            idx = self._served[key]
+            if not candidates or (idx >= len(candidates) and not self.loop):
+                raise CassetteError(f"No recorded response for {key[0] or key[1]}")
+
+            self._served[key] += 1
+            return candidates[idx % len(candidates)]
+
+    def send(self, request, **kwargs):
+        body = request.body
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+
+        key = (
+            _soap_action(request.headers),
+            _redact(body).decode("utf-8", errors="replace"),
+        )
+        interaction = self._next_interaction(key)
+
+        if self.speed:
+            time.sleep(interaction["elapsed"] / self.speed)
+
+        resp = requests.Response()
+        resp.status_code = interaction["status"]
+        resp.reason = "Recorded"
+        resp.headers = requests.structures.CaseInsensitiveDict(
+            {"Content-Type": "text/xml; charset=utf-8"}
+        )
+        resp.encoding = "utf-8"
+        resp.url = request.url
+        resp.request = request
+        resp.elapsed = datetime.timedelta(seconds=interaction["elapsed"])
+        resp._content = interaction["response"].encode("utf-8")
+
+        return resp
+
+    def close(self):
+        pass
+
+
+@contextlib.contextmanager
+def _mounted(client, adapter):
+    url = client.HNAP_AUTH["url"]
+    client.session.mount(url, adapter)
+
+    try:
+        yield adapter
+
+    finally:
+        if client.session.adapters.get(url) is adapter:
+            del client.session.adapters[url]
+        adapter.close()
+
+
+@contextlib.contextmanager
+def record(client, path):
+    with _mounted(client, RecordingAdapter()) as adapter:
+        try:
+            yield adapter
+        finally:
+            save_cassette(path, adapter.interactions)
+            _LOGGER.debug(f"{path}: {len(adapter.interactions)} interactions saved")
+
+
+@contextlib.contextmanager
+def replay(client, path, speed=None, loop=True):
+    adapter = ReplayAdapter(load_cassette(path), speed=speed, loop=loop)
+    with _mounted(client, adapter):
+        yield adapter
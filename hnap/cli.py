@@ -18,15 +18,21 @@
 
 
 import argparse
+import datetime
+import json
 import logging
 import os
-import pprint
 import sys
-import xml.dom.minidom
+import time
 
-import requests
-
-from .soapclient import SoapClient
+from .const import (
+    DEFAULT_CLI_WATCH_INTERVAL,
+    DEFAULT_CLI_WORKERS,
+    DEFAULT_DISCOVERY_CONCURRENCY,
+    DEFAULT_DISCOVERY_TIMEOUT,
+    DEFAULT_PORT,
+    DEFAULT_USERNAME,
+)
 
 OUTPUT_TMPL = """
 Device info
@@ -43,37 +49,48 @@ Module actions
 """
 
 
-def main():
-    logging.basicConfig()
-    logging.getLogger("hnap").setLevel(logging.DEBUG)
+def _parse_host(value):
+    # host, host:port or [ipv6]:port
+    host, sep, port = value.rpartition(":")
+    if not sep or not port.isdigit() or (":" in host and not host.endswith("]")):
+        return value.strip("[]"), DEFAULT_PORT
 
-    parser = argparse.ArgumentParser()
-    parser.add_argument(
-        "--hostname",
-        required=True,
-        metavar="hostname",
-    )
+    return host.strip("[]"), int(port)
+
+
+def _read_hosts(path):
+    fh = sys.stdin if path == "-" else open(path)
+    with fh:
+        for line in fh:
+            line = line.split("#", 1)[0].strip()
+            if line:
+                yield line
+
+
+def _add_auth_arguments(parser):
     parser.add_argument(
         "--password",
-        required=True,
+        required="HNAP_PASSWORD" not in os.environ,
         metavar="password",
         default=os.environ.get("HNAP_PASSWORD", ""),
     )
     parser.add_argument(
         "--username",
-        default="admin",
+        default=DEFAULT_USERNAME,
         metavar="username",
     )
     parser.add_argument(
-        "--call",
-        nargs=1,
-        default=[],
-        metavar="MethodName",
+        "--session-store",
+        default=os.environ.get("HNAP_SESSION_STORE"),
+        metavar="path",
         help=(
-            "If you are calling a SOAP action you must pass, at least, "
-            "`--param Module 1` and, maybe, `--param Controller 1`."
+            "Keep sessions in this file between runs to skip the login "
+            "handshake. Use a .db or .sqlite suffix for a SQLite store."
         ),
     )
+
+
+def _add_param_argument(parser):
     parser.add_argument(
         "--param",
         action="append",
@@ -83,12 +100,237 @@ def main():
         metavar=("ParamName", "Value"),
         help="Params to pass to call. Multiple params can be passed.",
     )
-    args = parser.parse_args()
 
+
+def _error_message(e):
+    # Client errors carry the status code as a second argument
+    return str(e.args[0]) if e.args else type(e).__name__
+
+
+def _build_parser():
+    parser = argparse.ArgumentParser(
+        prog="hnap",
+        epilog=(
+            "Use 'hnap watch --help' to poll a device for changes and "
+            "'hnap discover --help' to find devices."
+        ),
+    )
+    parser.add_argument(
+        "--hostname",
+        action="append",
+        default=[],
+        dest="hostnames",
+        metavar="hostname",
+        help="Device hostname or hostname:port. Can be repeated.",
+    )
+    parser.add_argument(
+        "--hosts-file",
+        metavar="path",
+        help="Read hostnames from this file, one per line ('-' for stdin)",
+    )
+    _add_auth_arguments(parser)
+    parser.add_argument(
+        "--call",
+        nargs=1,
+        default=[],
+        metavar="MethodName",
+        help=(
+            "If you are calling a SOAP action you must pass, at least, "
+            "`--param Module 1` and, maybe, `--param Controller 1`."
+        ),
+    )
+    _add_param_argument(parser)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_CLI_WORKERS,
+        metavar="N",
+        help="Hosts inspected concurrently",
+    )
+    parser.add_argument(
+        "--ndjson",
+        action="store_true",
+        help=(
+            "Print one JSON line per host as soon as it finishes. Implied with "
+            "more than one host."
+        ),
+    )
+
+    return parser
+
+
+def _build_watch_parser():
+    parser = argparse.ArgumentParser(
+        prog="hnap watch",
+        description=(
+            "Call a method periodically and print a line each time the "
+            "response changes."
+        ),
+    )
+    parser.add_argument("method", metavar="MethodName")
+    parser.add_argument(
+        "--hostname",
+        required=True,
+        metavar="hostname",
+        help="Device hostname or hostname:port",
+    )
+    _add_auth_arguments(parser)
+    _add_param_argument(parser)
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=DEFAULT_CLI_WATCH_INTERVAL,
+        metavar="seconds",
+    )
+    parser.add_argument(
+        "--count",
+        type=int,
+        metavar="N",
+        help="Stop after N calls",
+    )
+    parser.add_argument(
+        "--ndjson",
+        action="store_true",
+        help="Print JSON lines instead of text",
+    )
+
+    return parser
+
+
+def _build_discover_parser():
+    parser = argparse.ArgumentParser(
+        prog="hnap discover",
+        description="Look for HNAP devices, no credentials needed.",
+    )
+    parser.add_argument(
+        "targets",
+        nargs="*",
+        metavar="target",
+        help="Network (ex. 192.168.1.0/24), address, hostname or hostname:port",
+    )
+    parser.add_argument(
+        "--targets-file",
+        metavar="path",
+        help="Read targets from this file, one per line ('-' for stdin)",
+    )
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=DEFAULT_DISCOVERY_TIMEOUT,
+        metavar="seconds",
+        help="Per host connect and read timeout",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=DEFAULT_DISCOVERY_CONCURRENCY,
+        metavar="N",
+        help="Hosts probed concurrently",
+    )
+    parser.add_argument(
+        "--ndjson",
+        action="store_true",
+        help="Print one JSON line per device instead of text",
+    )
+
+    return parser
+
+
+def _session_store(path):
+    from .sessionstore import FileSessionStore, SQLiteSessionStore
+
+    if not path:
+        return None
+
+    if path.endswith((".db", ".sqlite")):
+        return SQLiteSessionStore(path)
+
+    return FileSessionStore(path)
+
+
+def _inspect_host(args, host, session_store):
+    from .soapclient import SoapClient
+
+    hostname, port = _parse_host(host)
+    ret = {"hostname": hostname, "port": port, "ok": True}
+    started = time.monotonic()
+
+    try:
+        with SoapClient(
+            hostname=hostname,
+            port=port,
+            username=args.username,
+            password=args.password,
+            session_store=session_store,
+            renew_margin=None,
+        ) as client:
+            client.authenticate()
+
+            if args.call:
+                method = args.call[0]
+                ret["method"] = method
+                # Raises MethodCallError unless {method}Result is OK
+                ret["response"] = client.call(method, **dict(args.params))
+            else:
+                ret["info"] = client.device_info()
+                ret["device_actions"] = client.device_actions()
+                ret["module_actions"] = client.module_actions()
+
+    except Exception as e:
+        ret["ok"] = False
+        ret["error"] = _error_message(e)
+        ret["error_type"] = type(e).__name__
+
+    ret["elapsed"] = round(time.monotonic() - started, 3)
+    return ret
+
+
+def _main_ndjson(args, hosts):
+    import concurrent.futures
+
+    session_store = _session_store(args.session_store)
+    failed = 0
+
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=max(1, min(args.workers, len(hosts)))
+    ) as executor:
+        futures = [
+            executor.submit(_inspect_host, args, host, session_store) for host in hosts
+        ]
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                ret = future.result()
+                failed += not ret["ok"]
+                print(json.dumps(ret, default=str), flush=True)
+
+        except KeyboardInterrupt:
+            for future in futures:
+                future.cancel()
+            raise
+
+    sys.exit(1 if failed else 0)
+
+
+def _main_single(args, hostname):
+    # Imported after parsing arguments: --help or a usage error don't need
+    # requests and the whole client
+    import pprint
+    import xml.dom.minidom
+
+    import requests
+
+    from .soapclient import SoapClient
+
+    logging.getLogger("hnap").setLevel(logging.DEBUG)
+
+    hostname, port = _parse_host(hostname)
     client = SoapClient(
-        hostname=args.hostname,
+        hostname=hostname,
+        port=port,
         username=args.username,
         password=args.password,
+        session_store=_session_store(args.session_store),
     )
 
     try:
@@ -96,14 +338,13 @@ def main():
 
     except requests.ReadTimeout:
         print(
-            f"{args.hostname}: read timeout error "
-            "(Is device stuck? try rebooting it)",
+            f"{hostname}: read timeout error (Is device stuck? try rebooting it)",
             file=sys.stderr,
         )
         sys.exit(1)
     except requests.ConnectionError:
         print(
-            f"{args.hostname}: connection error (offline device? wrong hostname?)",
+            f"{hostname}: connection error (offline device? wrong hostname?)",
             file=sys.stderr,
         )
         sys.exit(1)
@@ -128,5 +369,188 @@ def main():
         )
 
 
+def _diff(previous, current):
+    changed = {k: v for k, v in current.items() if previous.get(k) != v}
+    removed = [k for k in previous if k not in current]
+    return changed, removed
+
+
+def _format_watch_event(event):
+    parts = [event["time"], f"{event['latency'] * 1000:.0f}ms"]
+
+    if "error" in event:
+        parts.append(f"error: {event['error']}")
+    else:
+        fields = event.get("response", event.get("changed", {}))
+        parts.extend(f"{k}={v}" for k, v in fields.items())
+        parts.extend(f"-{k}" for k in event.get("removed", []))
+
+    return " ".join(parts)
+
+
+def _main_watch(argv):
+    args = _build_watch_parser().parse_args(argv)
+
+    import requests
+
+    from .soapclient import ClientError, SoapClient
+
+    hostname, port = _parse_host(args.hostname)
+    params = dict(args.params)
+    client = SoapClient(
+        hostname=hostname,
+        port=port,
+        username=args.username,
+        password=args.password,
+        session_store=_session_store(args.session_store),
+    )
+
+    # Only transitions are printed: the first response, then changed fields
+    # (removed ones prefixed by '-'). Errors are printed once, until the
+    # device answers again.
+    previous = None
+    last_error = None
+    calls = 0
+
+    try:
+        while args.count is None or calls < args.count:
+            started = time.monotonic()
+            event = {
+                "time": datetime.datetime.now().isoformat(timespec="seconds"),
+            }
+
+            try:
+                # Log in before the first call, and again while it keeps
+                # failing. Login errors are reported like call errors.
+                if not client.is_authenticated():
+                    client.authenticate()
+
+                resp = client.call(args.method, **params)
+                resp.pop("@xmlns", None)
+
+            except (ClientError, requests.RequestException) as e:
+                event["latency"] = round(time.monotonic() - started, 3)
+                error = _error_message(e)
+                if error != last_error:
+                    event["error"] = last_error = error
+                previous = None
+
+            else:
+                event["latency"] = round(time.monotonic() - started, 3)
+                last_error = None
+                if previous is None:
+                    event["response"] = resp
+                else:
+                    changed, removed = _diff(previous, resp)
+                    if changed:
+                        event["changed"] = changed
+                    if removed:
+                        event["removed"] = removed
+                previous = resp
+
+            if len(event) > 2:
+                if args.ndjson:
+                    print(json.dumps(event, default=str), flush=True)
+                else:
+                    print(_format_watch_event(event), flush=True)
+
+            calls += 1
+            if args.count is None or calls < args.count:
+                time.sleep(max(0, args.interval - (time.monotonic() - started)))
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        client.close()
+
+
+def _main_discover(argv):
+    parser = _build_discover_parser()
+    args = parser.parse_args(argv)
+
+    targets = list(args.targets)
+    if args.targets_file:
+        try:
+            targets.extend(_read_hosts(args.targets_file))
+        except OSError as e:
+            parser.error(f"unable to read targets file: {e}")
+
+    if not targets:
+        parser.error("at least one target or --targets-file is required")
+
+    import asyncio
+
+    from .discovery import async_discover
+
+    # Devices are printed as they answer
+    async def _discover():
+        async for device in async_discover(
+            targets,
+            port=args.port,
+            timeout=args.timeout,
+            concurrency=args.concurrency,
+        ):
+            info = device.info
+            found = {
+                "hostname": device.hostname,
+                "port": device.port,
+                "device_class": (
+                    device.device_class.__name__ if device.device_class else None
+                ),
+                "model": info.model if info else None,
+                "type": info.type if info else None,
+                "name": info.name if info else None,
+                "firmware_version": info.firmware_version if info else None,
+                "module_types": list(info.module_types) if info else [],
+            }
+
+            if args.ndjson:
+                print(json.dumps(found), flush=True)
+            else:
+                print(
+                    f"{device.hostname}:{device.port}\t"
+                    + f"{found['device_class'] or '-'}\t"
+                    + f"{found['model'] or '-'}\t"
+                    + f"{found['firmware_version'] or '-'}",
+                    flush=True,
+                )
+
+    try:
+        asyncio.run(_discover())
+    except KeyboardInterrupt:
+        pass
+
+
+def main():
+    logging.basicConfig()
+
+    if sys.argv[1:2] == ["watch"]:
+        _main_watch(sys.argv[2:])
+        return
+
+    if sys.argv[1:2] == ["discover"]:
+        _main_discover(sys.argv[2:])
+        return
+
+    parser = _build_parser()
+    args = parser.parse_args()
+
+    hosts = list(args.hostnames)
+    if args.hosts_file:
+        try:
+            hosts.extend(_read_hosts(args.hosts_file))
+        except OSError as e:
+            parser.error(f"unable to read hosts file: {e}")
+
+    if not hosts:
+        parser.error("at least one --hostname or --hosts-file is required")
+
+    if len(hosts) == 1 and not args.ndjson:
+        _main_single(args, hosts[0])
+    else:
+        _main_ndjson(args, hosts)
+
+
 if __name__ == "__main__":
     main()
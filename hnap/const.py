@@ -17,8 +17,34 @@
 # USA.
 
 
+DEFAULT_ADAPTIVE_CONNECT_TIMEOUT = 2
+DEFAULT_ADAPTIVE_CONNECT_TIMEOUT_MIN = 0.2
+DEFAULT_ADAPTIVE_TIMEOUT_FACTOR = 2
+DEFAULT_ADAPTIVE_TIMEOUT_MIN = 0.3
+DEFAULT_ADAPTIVE_TIMEOUT_WARMUP = 3
+DEFAULT_BREAKER_FAILURE_THRESHOLD = 3
+DEFAULT_BREAKER_MAX_RESET_TIMEOUT = 300
+DEFAULT_BREAKER_PROBE_TIMEOUT = 2
+DEFAULT_BREAKER_RESET_TIMEOUT = 15
+DEFAULT_CAPABILITY_TTL = 3600
+DEFAULT_CLI_WATCH_INTERVAL = 5
+DEFAULT_CLI_WORKERS = 16
+DEFAULT_DISCOVERY_CONCURRENCY = 256
+DEFAULT_DISCOVERY_TIMEOUT = 1
 DEFAULT_MODULE_ID = "1"
+DEFAULT_MOTION_BACKOFF = 30
+DEFAULT_POOL_IDLE_TIMEOUT = 30
+DEFAULT_POOL_SIZE = 4
 DEFAULT_PORT = 80
 DEFAULT_REQUEST_TIMEOUT = 10
+DEFAULT_RETRY_ATTEMPTS = 3
+DEFAULT_RETRY_BACKOFF = 0.2
+DEFAULT_RETRY_MAX_BACKOFF = 5
+DEFAULT_SCHEDULER_JITTER = 0.1
+DEFAULT_SCHEDULER_MAX_PER_HOST = 1
+DEFAULT_SCHEDULER_WORKERS = 16
 DEFAULT_SESSION_LIFETIME = 3600
+DEFAULT_SESSION_RENEW_MARGIN = 60
+DEFAULT_SNAPSHOT_CONCURRENCY = 4
 DEFAULT_USERNAME = "admin"
+DEFAULT_WATCH_MIN_INTERVAL = 1
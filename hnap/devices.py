@@ -17,17 +17,240 @@
 # USA.
 
 
+import concurrent.futures
 import logging
-from datetime import datetime
+import time
+from datetime import datetime, timedelta
 from enum import Enum
-
-from .const import DEFAULT_MODULE_ID, DEFAULT_PORT, DEFAULT_USERNAME
+from typing import NamedTuple
+
+import requests
+
+from .const import (
+    DEFAULT_MODULE_ID,
+    DEFAULT_MOTION_BACKOFF,
+    DEFAULT_PORT,
+    DEFAULT_SNAPSHOT_CONCURRENCY,
+    DEFAULT_USERNAME,
+    DEFAULT_WATCH_MIN_INTERVAL,
+)
 from .helpers import auth_required
-from .soapclient import MethodCallError, SoapClient
+from .models import (
+    DeviceInfo,
+    ModuleActions,
+    MotionState,
+    RouterClient,
+    SirenState,
+    Snapshot,
+    WaterState,
+)
+from .parser import iter_elements
+from .soapclient import ClientError, MethodCallError, SoapClient
 
 _LOGGER = logging.getLogger(__name__)
 
 
+def _device_class_for(info, classes):
+    module_types = info["ModuleTypes"]
+    if not isinstance(module_types, list):
+        module_types = [module_types]
+
+    for module_type, cls in classes:
+        if module_type in module_types:
+            return cls
+
+    raise TypeError(module_types)
+
+
+def _camera_base_url(client, schema):
+    return (
+        schema
+        + f"{client.username.lower()}:{client.password}@"
+        + f"{client.hostname}:{client.port}"
+    )
+
+
+def _parse_backoff(resp):
+    try:
+        return int(resp["Backoff"])
+    except (KeyError, ValueError, TypeError):
+        return None
+
+
+def _parse_latest_detection(resp):
+    return datetime.fromtimestamp(float(resp["LatestDetectTime"]))
+
+
+def _is_within_backoff(detection, backoff):
+    diff = (datetime.now() - detection).total_seconds()
+    return diff <= backoff
+
+
+def _parse_clients(resp):
+    clients = resp["ClientInfoLists"]["ClientInfo"]
+    if not isinstance(clients, list):
+        clients = [clients]
+
+    # Filter out offline clients
+    # clients = [x for x in clients if x["Type"] != "OFFLINE"]
+
+    return [
+        {
+            "name": client["DeviceName"],
+            "nickName": client["NickName"],
+            "is_connected": client["Type"] == "OFFLINE" and 0 or 1,
+            "mac": client["MacAddress"],
+        }
+        for client in clients
+    ]
+
+
+class MotionEventType(Enum):
+    START = "start"
+    END = "end"
+
+
+class MotionEvent(NamedTuple):
+    type: MotionEventType
+    time: datetime
+
+
+class _MotionWatcher:
+    # Edge detector for LatestDetectTime. While motion is active there is
+    # nothing to learn until the backoff elapses; while idle the polling
+    # interval grows from min_interval up to max_interval (the device backoff
+    # by default) and goes back to min_interval after any activity.
+    IDLE_INTERVAL_FACTOR = 1.5
+
+    def __init__(self, min_interval, max_interval=None):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+
+        self.active = False
+        self.detection = None
+        self.backoff = DEFAULT_MOTION_BACKOFF
+        self._interval = min_interval
+
+    @property
+    def end(self):
+        return self.detection + timedelta(seconds=self.backoff)
+
+    def update(self, detection, backoff):
+        self.backoff = backoff
+        now = datetime.now()
+        events = []
+
+        if detection != self.detection:
+            known = self.detection is not None
+            self.detection = detection
+
+            if not self.active and (now <= self.end or known):
+                self.active = True
+                events.append(MotionEvent(MotionEventType.START, detection))
+
+            if known:
+                self._interval = self.min_interval
+
+        if self.active and now > self.end:
+            self.active = False
+            events.append(MotionEvent(MotionEventType.END, self.end))
+
+        return events
+
+    def delay(self):
+        max_interval = self.max_interval or self.backoff
+
+        if self.active:
+            remaining = (self.end - datetime.now()).total_seconds()
+            return min(max(remaining, self.min_interval), max_interval)
+
+        ret = self._interval
+        self._interval = min(self._interval * self.IDLE_INTERVAL_FACTOR, max_interval)
+        return ret
+
+
+class ClientEventType(Enum):
+    JOIN = "join"
+    LEAVE = "leave"
+    RENAME = "rename"
+
+
+class ClientEvent(NamedTuple):
+    type: ClientEventType
+    mac: str
+    name: str
+    nickname: str
+
+
+_CLIENT_FIELDS = frozenset(["MacAddress", "Type", "DeviceName", "NickName"])
+
+
+def _iter_client_elements(body, fields):
+    # Streams GetClientInfo responses, the result comes before the list so a
+    # failed call is detected before any client is reported
+    tags = {"GetClientInfoResult", "ClientInfo"}
+    for tag, value in iter_elements(body, tags, fields=fields):
+        if tag == "GetClientInfoResult":
+            if value != "OK":
+                raise MethodCallError(f"GetClientInfo returned {value}")
+            continue
+
+        yield value
+
+
+def _iter_client_records(body):
+    for value in _iter_client_elements(body, _CLIENT_FIELDS):
+        if value.get("Type") != "OFFLINE" and value.get("MacAddress"):
+            yield (
+                value["MacAddress"].upper(),
+                value.get("DeviceName") or "",
+                value.get("NickName") or "",
+            )
+
+
+class _ClientTracker:
+    # Table of connected clients, MAC -> (name, nickname). Offline clients
+    # and clients missing from the list are gone.
+
+    def __init__(self):
+        self.clients = {}
+
+    def update(self, records):
+        current = {}
+        events = []
+
+        for mac, name, nickname in records:
+            entry = (name, nickname)
+            known = self.clients.get(mac)
+            if known is None:
+                events.append(ClientEvent(ClientEventType.JOIN, mac, name, nickname))
+            elif known != entry:
+                events.append(ClientEvent(ClientEventType.RENAME, mac, name, nickname))
+            else:
+                entry = known
+
+            current[mac] = entry
+
+        for mac, (name, nickname) in self.clients.items():
+            if mac not in current:
+                events.append(ClientEvent(ClientEventType.LEAVE, mac, name, nickname))
+
+        self.clients = current
+        return events
+
+
+def _snapshot_methods(module_actions):
+    # Getters that take nothing but the ModuleID
+    return [
+        x for x in module_actions if x.startswith("Get") and x != "GetModuleSOAPActions"
+    ]
+
+
+def _check_ok_result(resp, method, error):
+    if resp[f"{method}Result"] != "OK":
+        raise MethodCallError(f"{error}. Response: {resp}")
+
+
 def DeviceFactory(
     *,
     client=None,
@@ -40,24 +263,7 @@ def DeviceFactory(
         hostname=hostname, password=password, username=username, port=port
     )
     info = client.device_info()
-
-    module_types = info["ModuleTypes"]
-    if not isinstance(module_types, list):
-        module_types = [module_types]
-
-    if "Audio Renderer" in module_types:
-        cls = Siren
-
-    elif "Camera" in module_types:
-        # Other posible values for camera (needs testing):
-        # 'Optical Recognition', 'Environmental Sensor', 'Camera'
-        cls = Camera
-
-    elif "Motion Sensor" in module_types:
-        cls = Motion
-
-    else:
-        raise TypeError(module_types)
+    cls = _device_class_for(info, _FACTORY_CLASSES)
 
     return cls(client=client)
 
@@ -81,6 +287,7 @@ class Device:
         self.module_id = module_id
 
         self._info = None
+        self._device_info = None
 
     @property
     def info(self):
@@ -89,10 +296,53 @@ class Device:
 
         return self._info
 
+    def get_device_info(self):
+        # Typed alternative to .info
+        if self._device_info is None:
+            self._device_info = DeviceInfo.from_response(
+                self.info, self.client.device_actions()
+            )
+
+        return self._device_info
+
+    def get_module_actions(self):
+        return ModuleActions.from_response(
+            self.client.module_actions(ModuleID=self.module_id), self.module_id
+        )
+
     def call(self, *args, **kwargs):
         kwargs["ModuleID"] = self.module_id
         return self.client.call(*args, **kwargs)
 
+    def call_many(self, calls):
+        return self.client.call_many(
+            (method, dict(parameters, ModuleID=self.module_id))
+            for (method, parameters) in calls
+        )
+
+    @auth_required
+    def snapshot(self, actions=None, concurrency=DEFAULT_SNAPSHOT_CONCURRENCY):
+        # Runs every advertised Get* action (or `actions`), up to
+        # `concurrency` at once over the client's session
+        info = self.get_device_info()
+        module_actions = self.get_module_actions()
+        methods = (
+            _snapshot_methods(module_actions) if actions is None else list(actions)
+        )
+
+        def _fetch(method):
+            try:
+                return self.call(method)
+            except ClientError as e:
+                return e
+
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, min(concurrency, len(methods)))
+        ) as executor:
+            responses = list(zip(methods, executor.map(_fetch, methods)))
+
+        return Snapshot.from_responses(info, module_actions, responses)
+
     def is_authenticated(self):
         return self.client.is_authenticated()
 
@@ -108,11 +358,7 @@ class Camera(Device):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self._base_url = (
-            {self.DEFAULT_SCHEMA}
-            + f"{self.client.username.lower()}:{self.client.password}@"
-            + f"{self.client.hostname}:{self.client.port}"
-        )
+        self._base_url = _camera_base_url(self.client, self.DEFAULT_SCHEMA)
 
     @property
     def stream_url(self):
@@ -133,13 +379,11 @@ class Motion(Device):
     @property
     def backoff(self):
         if self._backoff is None:
-            resp = self.call("GetMotionDetectorSettings")
-            try:
-                self._backoff = int(resp["Backoff"])
-            except (KeyError, ValueError, TypeError):
+            self._backoff = _parse_backoff(self.call("GetMotionDetectorSettings"))
+            if self._backoff is None:
                 # Return the default value for tested devices but don't store
                 # to force retry
-                return 30
+                return DEFAULT_MOTION_BACKOFF
 
         return self._backoff
 
@@ -161,15 +405,27 @@ class Motion(Device):
 
     @auth_required
     def get_latest_detection(self):
-        res = self.call("GetLatestDetection")
-        return datetime.fromtimestamp(float(res["LatestDetectTime"]))
+        return _parse_latest_detection(self.call("GetLatestDetection"))
 
     @auth_required
     def is_active(self):
-        now = datetime.now()
-        diff = (now - self.get_latest_detection()).total_seconds()
+        return _is_within_backoff(self.get_latest_detection(), self.backoff)
+
+    @auth_required
+    def get_state(self):
+        return MotionState.from_response(self.call("GetLatestDetection"), self.backoff)
 
-        return diff <= self.backoff
+    def watch(self, min_interval=DEFAULT_WATCH_MIN_INTERVAL, max_interval=None):
+        watcher = _MotionWatcher(min_interval, max_interval)
+
+        while True:
+            try:
+                yield from watcher.update(self.get_latest_detection(), self.backoff)
+
+            except (ClientError, requests.RequestException) as e:
+                _LOGGER.warning(f"{self.client.hostname}: unable to poll: {e}")
+
+            time.sleep(watcher.delay())
 
 
 class Router(Device):
@@ -177,24 +433,33 @@ class Router(Device):
     # See https://github.com/waffelheld/dlink-device-tracker/blob/master/custom_components/dlink_device_tracker/dlink_hnap.py#L95  # noqa: E501
     MODULE_TYPE = "check-module-types-for-router"
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._tracker = _ClientTracker()
+
+    @property
+    def known_clients(self):
+        return dict(self._tracker.clients)
+
     @auth_required
     def get_clients(self):
-        res = self.call("GetClientInfo")
-        clients = res["ClientInfoLists"]["ClientInfo"]
-
-        # Filter out offline clients
-        # clients = [x for x in clients if x["Type"] != "OFFLINE"]
-
-        ret = [
-            {
-                "name": client["DeviceName"],
-                "nickName": client["NickName"],
-                "is_connected": client["Type"] == "OFFLINE" and 0 or 1,
-                "mac": client["MacAddress"],
-            }
-            for client in clients
+        return _parse_clients(self.call("GetClientInfo"))
+
+    @auth_required
+    def poll_clients(self):
+        # Changes since the previous poll, the first one reports every
+        # connected client as joined
+        body = self.client.call_raw("GetClientInfo", ModuleID=self.module_id)
+        return self._tracker.update(_iter_client_records(body))
+
+    @auth_required
+    def get_client_list(self):
+        # Typed alternative to get_clients()
+        body = self.client.call_raw("GetClientInfo", ModuleID=self.module_id)
+        return [
+            RouterClient.from_element(x)
+            for x in _iter_client_elements(body, RouterClient.FIELDS)
         ]
-        return ret
 
 
 class SirenSound(Enum):
@@ -222,6 +487,10 @@ class Siren(Device):
         res = self.call("GetSirenAlarmSettings")
         return res["IsSounding"] == "true"
 
+    @auth_required
+    def get_state(self):
+        return SirenState.from_response(self.call("GetSirenAlarmSettings"))
+
     @auth_required
     def play(self, sound=SirenSound.EMERGENCY, volume=100, duration=60):
         ret = self.call(
@@ -230,8 +499,7 @@ class Siren(Device):
             Volume=volume,
             Duration=duration,
         )
-        if ret["SetSoundPlayResult"] != "OK":
-            raise MethodCallError(f"Unable to play. Response: {ret}")
+        _check_ok_result(ret, "SetSoundPlay", "Unable to play")
 
     @auth_required
     def beep(self, volume=100, duration=1):
@@ -240,9 +508,7 @@ class Siren(Device):
     @auth_required
     def stop(self):
         ret = self.call("SetAlarmDismissed")
-
-        if ret["SetAlarmDismissedResult"] != "OK":
-            raise MethodCallError(f"Unable to stop. Response: {ret}")
+        _check_ok_result(ret, "SetAlarmDismissed", "Unable to stop")
 
 
 class Water(Device):
@@ -253,3 +519,16 @@ class Water(Device):
     def is_active(self):
         ret = self.call("GetWaterDetectorState")
         return ret.get("IsWater") == "true"
+
+    @auth_required
+    def get_state(self):
+        return WaterState.from_response(self.call("GetWaterDetectorState"))
+
+
+_FACTORY_CLASSES = [
+    (Siren.MODULE_TYPE, Siren),
+    # Other posible values for camera (needs testing):
+    # 'Optical Recognition', 'Environmental Sensor', 'Camera'
+    (Camera.MODULE_TYPE, Camera),
+    (Motion.MODULE_TYPE, Motion),
+]
@@ -0,0 +1,313 @@
+#
+# Copyright (C) 2021 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import asyncio
+import ipaddress
+import logging
+import xml.parsers.expat
+from typing import NamedTuple
+
+from .const import (
+    DEFAULT_DISCOVERY_CONCURRENCY,
+    DEFAULT_DISCOVERY_TIMEOUT,
+    DEFAULT_PORT,
+)
+from .models import DeviceInfo
+from .parser import parse_element
+
+_LOGGER = logging.getLogger(__name__)
+
+HNAP_PATH = "/HNAP1/"
+HNAP_XMLNS = b"http://purenetworks.com/HNAP1/"
+
+# Device settings are a few KiB, anything past this is not worth reading
+MAX_RESPONSE_SIZE = 1 << 16
+
+
+class DiscoveredDevice(NamedTuple):
+    hostname: str
+    port: int
+    info: DeviceInfo | None
+    device_class: type | None
+
+    def factory_kwargs(self, **kwargs):
+        # DeviceFactory(**device.factory_kwargs(password=...))
+        return dict(hostname=self.hostname, port=self.port, **kwargs)
+
+
+def _parse_target(value, port):
+    # (network, port) for CIDR ranges and addresses, (hostname, port) for
+    # hostnames, host:port or [ipv6]:port
+    try:
+        return ipaddress.ip_network(value, strict=False), port
+    except ValueError:
+        pass
+
+    host, sep, target_port = value.rpartition(":")
+    if not sep or not target_port.isdigit() or (":" in host and not host.endswith("]")):
+        return value.strip("[]"), port
+
+    return host.strip("[]"), int(target_port)
+
+
+def _addresses(network):
+    return network.hosts() if network.num_addresses > 1 else iter([network[0]])
+
+
+def iter_targets(targets, port=DEFAULT_PORT):
+    # Networks are expanded lazily, a /8 is never held in memory. Duplicates
+    # are skipped: single hosts are remembered, addresses are checked
+    # against the networks seen so far.
+    seen = set()
+    networks = []
+
+    for target in targets:
+        value, target_port = _parse_target(target.strip(), port)
+
+        if isinstance(value, str) or value.num_addresses == 1:
+            host = (value if isinstance(value, str) else str(value[0]), target_port)
+            if host in seen or (
+                not isinstance(value, str)
+                and any(value[0] in net for (net, p) in networks if p == target_port)
+            ):
+                continue
+
+            seen.add(host)
+            yield host
+            continue
+
+        for address in _addresses(value):
+            host = (str(address), target_port)
+            if host in seen or any(
+                address in net for (net, p) in networks if p == target_port
+            ):
+                continue
+
+            yield host
+
+        networks.append((value, target_port))
+
+
+def _target_order(targets, port):
+    # Sort key placing devices in the order iter_targets yields them
+    parsed = [_parse_target(target.strip(), port) for target in targets]
+
+    def _key(device):
+        try:
+            address = ipaddress.ip_address(device.hostname)
+        except ValueError:
+            address = None
+
+        for idx, (value, target_port) in enumerate(parsed):
+            if target_port != device.port:
+                continue
+
+            if isinstance(value, str):
+                if value == device.hostname:
+                    return idx, 0
+            elif address is not None and address in value:
+                return idx, int(address)
+
+        return len(parsed), 0
+
+    return _key
+
+
+def _dechunk(body):
+    ret = []
+    while body:
+        size, _, body = body.partition(b"\r\n")
+        size = int(size.split(b";", 1)[0] or b"0", 16)
+        if not size:
+            break
+        ret.append(body[:size])
+        body = body[size + 2 :]
+
+    return b"".join(ret)
+
+
+def _parse_http_response(data):
+    head, _, body = data.partition(b"\r\n\r\n")
+    status_line, *header_lines = head.decode("latin-1").split("\r\n")
+
+    parts = status_line.split(" ", 2)
+    if len(parts) < 2 or not parts[0].startswith("HTTP/") or not parts[1].isdigit():
+        return None, b""
+
+    headers = {}
+    for line in header_lines:
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        body = _dechunk(body)
+
+    return int(parts[1]), body
+
+
+def _identify(body):
+    # Devices answer an unauthenticated GET with their settings, wrapped in
+    # a SOAP envelope or as a bare DeviceSettings element
+    for tag in ("GetDeviceSettingsResponse", "DeviceSettings"):
+        try:
+            resp = parse_element(body, tag)
+        except xml.parsers.expat.ExpatError:
+            return None
+
+        if isinstance(resp, dict):
+            return DeviceInfo.from_response(resp)
+
+    return None
+
+
+def _device_class(info):
+    from .devices import _FACTORY_CLASSES, _device_class_for
+
+    if info is None:
+        return None
+
+    try:
+        return _device_class_for(
+            {"ModuleTypes": list(info.module_types)}, _FACTORY_CLASSES
+        )
+    except TypeError:
+        return None
+
+
+async def _fetch(hostname, port, timeout):
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_connection(hostname, port), timeout
+    )
+
+    try:
+        writer.write(
+            (
+                f"GET {HNAP_PATH} HTTP/1.1\r\n"
+                f"Host: {hostname}\r\n"
+                "Connection: close\r\n"
+                "\r\n"
+            ).encode("latin-1")
+        )
+
+        async def _read():
+            data = b""
+            while len(data) < MAX_RESPONSE_SIZE:
+                chunk = await reader.read(MAX_RESPONSE_SIZE - len(data))
+                if not chunk:
+                    break
+                data += chunk
+
+            return data
+
+        return await asyncio.wait_for(_read(), timeout)
+
+    finally:
+        writer.close()
+
+
+async def probe(hostname, port=DEFAULT_PORT, timeout=DEFAULT_DISCOVERY_TIMEOUT):
+    # DiscoveredDevice if there is an HNAP endpoint at hostname:port, None
+    # otherwise
+    try:
+        data = await _fetch(hostname, port, timeout)
+    except (OSError, asyncio.TimeoutError) as e:
+        _LOGGER.debug(f"{hostname}:{port}: {e!r}")
+        return None
+
+    status, body = _parse_http_response(data)
+    if status is None or HNAP_XMLNS not in body:
+        return None
+
+    info = _identify(body) if status == 200 else None
+    return DiscoveredDevice(hostname, port, info, _device_class(info))
+
+
+async def async_discover(
+    targets,
+    port=DEFAULT_PORT,
+    timeout=DEFAULT_DISCOVERY_TIMEOUT,
+    concurrency=DEFAULT_DISCOVERY_CONCURRENCY,
+):
+    # Yields devices as they answer, not in target order. concurrency workers
+    # pull targets lazily, found devices wait in a bounded queue until the
+    # caller takes them.
+    hosts = iter_targets(targets, port=port)
+    results = asyncio.Queue(maxsize=concurrency)
+    done = object()
+    stopped = False
+
+    async def _worker():
+        try:
+            for hostname, target_port in hosts:
+                # asyncio.wait_for may swallow a cancellation before 3.12,
+                # don't rely on it alone to stop
+                if stopped:
+                    return
+
+                device = await probe(hostname, target_port, timeout=timeout)
+                if device is not None:
+                    await results.put(device)
+
+        except Exception as e:
+            await results.put(e)
+
+        else:
+            await results.put(done)
+
+    workers = [asyncio.ensure_future(_worker()) for _ in range(max(1, concurrency))]
+
+    try:
+        remaining = len(workers)
+        while remaining:
+            item = await results.get()
+            if item is done:
+                remaining -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
+
+    finally:
+        stopped = True
+        for worker in workers:
+            worker.cancel()
+
+        await asyncio.gather(*workers, return_exceptions=True)
+
+
+def discover(
+    targets,
+    port=DEFAULT_PORT,
+    timeout=DEFAULT_DISCOVERY_TIMEOUT,
+    concurrency=DEFAULT_DISCOVERY_CONCURRENCY,
+):
+    # Blocking version of async_discover, found devices in target order.
+    # Accepts a single target too, ex. discover("192.168.1.0/24")
+    targets = [targets] if isinstance(targets, str) else list(targets)
+
+    async def _discover():
+        return [
+            x
+            async for x in async_discover(
+                targets, port=port, timeout=timeout, concurrency=concurrency
+            )
+        ]
+
+    found = asyncio.run(_discover())
+    return sorted(found, key=_target_order(targets, port))
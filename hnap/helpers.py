@@ -28,3 +28,14 @@ def auth_required(fn):
         return fn(access, *args, **kwargs)
 
     return _wrap
+
+
+def async_auth_required(fn):
+    @functools.wraps(fn)
+    async def _wrap(access, *args, **kwargs):
+        if not access.is_authenticated():
+            await access.authenticate()
+
+        return await fn(access, *args, **kwargs)
+
+    return _wrap
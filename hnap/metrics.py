@@ -0,0 +1,246 @@
+#
+# Copyright (C) 2021 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import bisect
+import collections
+import functools
+import threading
+
+# Seconds. Envelope building and parsing take tenths of milliseconds, device
+# round trips up to several seconds.
+DEFAULT_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+class Instrumentation:
+    # Hooks called by clients created with metrics=<Instrumentation>. All of
+    # them are no-ops, subclasses override the ones they need. Hooks run
+    # inline in the calling thread (or event loop), keep them fast.
+    #
+    # phase names: "build" (envelope and headers), "http" (connection, request
+    # and response body), "parse".
+    # login reasons: "login" (first one), "renewal" (expired or renewed
+    # session), "relogin" (session rejected by the device).
+    # connection states, once per HTTP request: "reused" (kept-alive
+    # connection), "new", "stale" (kept-alive connection found closed, the
+    # request is sent again on a "new" one). As seen by the client: shared
+    # sessions may open connections it doesn't know about.
+
+    def call_started(self, client, method):
+        pass
+
+    def call_finished(self, client, method, elapsed, error):
+        pass
+
+    def phase(self, client, method, phase, elapsed):
+        pass
+
+    def transferred(self, client, method, sent, received):
+        pass
+
+    def login(self, client, reason, elapsed, error):
+        pass
+
+    def connection(self, client, state):
+        pass
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        # Prometheus buckets are inclusive (value <= le)
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        ret = []
+        total = 0
+        for le, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            ret.append((le, total))
+
+        return ret
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(**labels):
+    if not labels:
+        return ""
+
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _format_le(le):
+    return "+Inf" if le == float("inf") else repr(le)
+
+
+class Metrics(Instrumentation):
+    # In-process aggregation of client events, exportable in Prometheus text
+    # format. Labels are kept to method, phase, reason and error type: a
+    # single instance can be shared by thousands of clients.
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, namespace="hnap"):
+        self.namespace = namespace
+        self._lock = threading.Lock()
+
+        histogram = functools.partial(Histogram, buckets)
+        self.calls = collections.defaultdict(histogram)
+        self.phases = collections.defaultdict(histogram)
+        self.logins = collections.defaultdict(histogram)
+        self.bytes_sent = collections.Counter()
+        self.bytes_received = collections.Counter()
+        self.errors = collections.Counter()
+        self.connections = collections.Counter()
+        self.in_flight = 0
+
+    def call_started(self, client, method):
+        with self._lock:
+            self.in_flight += 1
+
+    def call_finished(self, client, method, elapsed, error):
+        with self._lock:
+            self.in_flight -= 1
+            self.calls[method].observe(elapsed)
+            if error is not None:
+                self.errors[(method, type(error).__name__)] += 1
+
+    def phase(self, client, method, phase, elapsed):
+        with self._lock:
+            self.phases[phase].observe(elapsed)
+
+    def transferred(self, client, method, sent, received):
+        with self._lock:
+            self.bytes_sent[method] += sent
+            self.bytes_received[method] += received
+
+    def login(self, client, reason, elapsed, error):
+        with self._lock:
+            self.logins[reason].observe(elapsed)
+            if error is not None:
+                self.errors[("Login", type(error).__name__)] += 1
+
+    def connection(self, client, state):
+        with self._lock:
+            self.connections[state] += 1
+
+    def export(self):
+        with self._lock:
+            lines = []
+            self._export_histograms(
+                lines,
+                "call_duration_seconds",
+                "Duration of method calls, re-logins included.",
+                "method",
+                self.calls,
+            )
+            self._export_histograms(
+                lines,
+                "phase_duration_seconds",
+                "Duration of each request phase.",
+                "phase",
+                self.phases,
+            )
+            self._export_histograms(
+                lines,
+                "login_duration_seconds",
+                "Duration of login handshakes.",
+                "reason",
+                self.logins,
+            )
+            self._export_counter(
+                lines,
+                "sent_bytes_total",
+                "Request body bytes sent.",
+                {(("method", k),): v for k, v in self.bytes_sent.items()},
+            )
+            self._export_counter(
+                lines,
+                "received_bytes_total",
+                "Response body bytes received.",
+                {(("method", k),): v for k, v in self.bytes_received.items()},
+            )
+            self._export_counter(
+                lines,
+                "errors_total",
+                "Failed calls and logins by exception type.",
+                {
+                    (("method", method), ("type", type_)): v
+                    for (method, type_), v in self.errors.items()
+                },
+            )
+            self._export_counter(
+                lines,
+                "connections_total",
+                "HTTP requests by connection state: reused, new or stale.",
+                {(("state", k),): v for k, v in self.connections.items()},
+            )
+
+            name = f"{self.namespace}_calls_in_flight"
+            lines.append(f"# HELP {name} Method calls in progress.")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {self.in_flight}")
+
+        return "\n".join(lines) + "\n"
+
+    def _export_histograms(self, lines, name, help, label, histograms):
+        name = f"{self.namespace}_{name}"
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} histogram")
+
+        for value, histogram in sorted(histograms.items()):
+            for le, count in histogram.cumulative():
+                labels = _labels(**{label: value, "le": _format_le(le)})
+                lines.append(f"{name}_bucket{labels} {count}")
+
+            labels = _labels(**{label: value})
+            lines.append(f"{name}_sum{labels} {histogram.sum!r}")
+            lines.append(f"{name}_count{labels} {histogram.count}")
+
+    def _export_counter(self, lines, name, help, values):
+        name = f"{self.namespace}_{name}"
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} counter")
+
+        for labels, value in sorted(values.items()):
+            lines.append(f"{name}{_labels(**dict(labels))} {value}")
@@ -0,0 +1,358 @@
+#
+# Copyright (C) 2021 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import sys
+from datetime import datetime
+from types import MappingProxyType
+
+# Opt-in typed views of device responses. Values are decoded once, when the
+# model is built, and strings repeated across a fleet (model names, firmware
+# versions, action names...) are interned so thousands of models share them.
+
+_XMLNS = "http://purenetworks.com/HNAP1/"
+
+
+def _str(value):
+    return value if isinstance(value, str) else ""
+
+
+def _interned(value):
+    return sys.intern(value) if isinstance(value, str) else ""
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _bool(value):
+    return isinstance(value, str) and value.lower() == "true"
+
+
+def _timestamp(value):
+    try:
+        return datetime.fromtimestamp(float(value))
+    except (TypeError, ValueError, OverflowError, OSError):
+        return None
+
+
+def _strings(value):
+    # <Foo><string>a</string><string>b</string></Foo> as parsed, or the list
+    # already unwrapped by SoapClient
+    if isinstance(value, dict):
+        value = value.get("string")
+
+    if value is None:
+        return ()
+    if isinstance(value, str):
+        value = [value]
+
+    return tuple(_interned(x) for x in value)
+
+
+class _Model:
+    # Immutable, compared and hashed by value
+    __slots__ = ()
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values, strict=True):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+    def _values(self):
+        return tuple(getattr(self, x) for x in self.__slots__)
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return self._values() == other._values()
+
+    def __hash__(self):
+        return hash(self._values())
+
+    def __repr__(self):
+        fields = ", ".join(f"{x}={getattr(self, x)!r}" for x in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+    def __reduce__(self):
+        return (type(self), self._values())
+
+    def as_dict(self):
+        return {x: getattr(self, x) for x in self.__slots__}
+
+
+class DeviceInfo(_Model):
+    __slots__ = (
+        "type",
+        "name",
+        "vendor",
+        "model",
+        "description",
+        "firmware_version",
+        "hardware_version",
+        "mac",
+        "module_types",
+        "actions",
+    )
+
+    @classmethod
+    def from_response(cls, resp, actions=None):
+        # GetDeviceSettings response or device_info() plus device_actions()
+        if actions is None:
+            actions = _strings(resp.get("SOAPActions"))
+
+        return cls(
+            _interned(resp.get("Type")),
+            _str(resp.get("DeviceName")),
+            _interned(resp.get("VendorName")),
+            _interned(resp.get("ModelName")),
+            _interned(resp.get("ModelDescription")),
+            _interned(resp.get("FirmwareVersion")),
+            _interned(resp.get("HardwareVersion")),
+            _str(resp.get("DeviceMacId")).upper(),
+            _strings(resp.get("ModuleTypes")),
+            tuple(
+                sys.intern(x[len(_XMLNS) :] if x.startswith(_XMLNS) else x)
+                for x in actions
+            ),
+        )
+
+
+class ModuleActions(_Model):
+    __slots__ = ("module_id", "actions")
+
+    @classmethod
+    def from_response(cls, resp, module_id=None):
+        # GetModuleSOAPActions response or the list from module_actions()
+        if isinstance(resp, dict):
+            module_list = resp.get("ModuleSOAPList") or {}
+            module_id = module_list.get("ModuleID", module_id)
+            resp = (module_list.get("SOAPActions") or {}).get("Action")
+
+        if resp is None:
+            resp = []
+        elif isinstance(resp, str):
+            resp = [resp]
+
+        return cls(_interned(module_id), tuple(_interned(x) for x in resp))
+
+    def __contains__(self, action):
+        return action in self.actions
+
+    def __iter__(self):
+        return iter(self.actions)
+
+    def __len__(self):
+        return len(self.actions)
+
+
+class MotionState(_Model):
+    __slots__ = ("latest_detection", "backoff")
+
+    @classmethod
+    def from_response(cls, resp, backoff=None):
+        # GetLatestDetection response
+        return cls(_timestamp(resp.get("LatestDetectTime")), backoff)
+
+    @property
+    def is_active(self):
+        if self.latest_detection is None or self.backoff is None:
+            return False
+
+        diff = (datetime.now() - self.latest_detection).total_seconds()
+        return diff <= self.backoff
+
+
+class SirenState(_Model):
+    __slots__ = ("is_sounding", "sound_type", "volume", "duration")
+
+    @classmethod
+    def from_response(cls, resp):
+        # GetSirenAlarmSettings response
+        return cls(
+            _bool(resp.get("IsSounding")),
+            _int(resp.get("SoundType")),
+            _int(resp.get("Volume")),
+            _int(resp.get("Duration")),
+        )
+
+
+class WaterState(_Model):
+    __slots__ = ("is_water",)
+
+    @classmethod
+    def from_response(cls, resp):
+        # GetWaterDetectorState response
+        return cls(_bool(resp.get("IsWater")))
+
+
+class RouterClient(_Model):
+    __slots__ = ("mac", "name", "nickname", "ipv4_address", "type")
+
+    FIELDS = frozenset(["MacAddress", "DeviceName", "NickName", "IPv4Address", "Type"])
+
+    @classmethod
+    def from_element(cls, element):
+        # One ClientInfo element of a GetClientInfo response
+        return cls(
+            _str(element.get("MacAddress")).upper(),
+            _str(element.get("DeviceName")),
+            _str(element.get("NickName")),
+            _str(element.get("IPv4Address")),
+            _interned(element.get("Type")),
+        )
+
+    @property
+    def is_connected(self):
+        return self.type != "OFFLINE"
+
+
+def _flatten(prefix, value, ret):
+    if isinstance(value, dict):
+        for k, v in value.items():
+            if not k.startswith("@"):
+                _flatten(f"{prefix}/{k}", v, ret)
+
+    elif isinstance(value, list):
+        ret[sys.intern(prefix)] = tuple(value)
+
+    else:
+        ret[sys.intern(prefix)] = value
+
+
+class Snapshot:
+    # Full state of a device at some point: typed info and module actions
+    # plus the response of each Get* action flattened as "Method/Field" ->
+    # value. Failed actions are in `errors`, not in `values`.
+    __slots__ = ("info", "module_actions", "taken_at", "_values", "_errors")
+
+    IGNORED_FIELDS = frozenset(["ModuleID"])
+
+    def __init__(self, info, module_actions, values, errors=None, taken_at=None):
+        object.__setattr__(self, "info", info)
+        object.__setattr__(self, "module_actions", module_actions)
+        object.__setattr__(self, "taken_at", taken_at or datetime.now())
+        object.__setattr__(self, "_values", dict(values))
+        object.__setattr__(self, "_errors", dict(errors or {}))
+
+    @classmethod
+    def from_responses(cls, info, module_actions, responses):
+        # `responses` is an iterable of (method, response or exception)
+        values = {}
+        errors = {}
+
+        for method, resp in responses:
+            if isinstance(resp, Exception):
+                errors[method] = resp.args[0] if resp.args else str(resp)
+                continue
+
+            result = f"{method}Result"
+            for k, v in resp.items():
+                if (
+                    k != result
+                    and k not in cls.IGNORED_FIELDS
+                    and not k.startswith("@")
+                ):
+                    _flatten(f"{method}/{k}", v, values)
+
+        return cls(info, module_actions, values, errors)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+    @property
+    def values(self):
+        return MappingProxyType(self._values)
+
+    @property
+    def errors(self):
+        return MappingProxyType(self._errors)
+
+    def __getitem__(self, key):
+        return self._values[key]
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+
+        return (
+            self.info == other.info
+            and self.module_actions == other.module_actions
+            and self._values == other._values
+            and self._errors == other._errors
+        )
+
+    __hash__ = None
+
+    def __repr__(self):
+        return (
+            f"{type(self).__name__}(model={self.info.model!r}, "
+            + f"values={len(self._values)}, errors={len(self._errors)}, "
+            + f"taken_at={self.taken_at!r})"
+        )
+
+    def __reduce__(self):
+        return (
+            type(self),
+            (
+                self.info,
+                self.module_actions,
+                self._values,
+                self._errors,
+                self.taken_at,
+            ),
+        )
+
+    def diff(self, previous):
+        # Changed fields as key -> (old, new), None standing for a missing
+        # value. Device info changes are reported as "DeviceInfo/<field>".
+        if previous is None:
+            return {k: (None, v) for (k, v) in self._values.items()}
+
+        ret = {}
+
+        if self.info != previous.info:
+            for k in DeviceInfo.__slots__:
+                old, new = getattr(previous.info, k), getattr(self.info, k)
+                if old != new:
+                    ret[f"DeviceInfo/{k}"] = (old, new)
+
+        if self._values == previous._values:
+            return ret
+
+        old_values = previous._values
+        for k, v in self._values.items():
+            if k not in old_values or old_values[k] != v:
+                ret[k] = (old_values.get(k), v)
+
+        for k, v in old_values.items():
+            if k not in self._values:
+                ret[k] = (v, None)
+
+        return ret
@@ -0,0 +1,201 @@
+#
+# Copyright (C) 2021 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import xml.parsers.expat
+
+
+class _Done(Exception):
+    pass
+
+
+class _ResponseHandler:
+    # Builds the same structure as xmltodict.parse() would (default options)
+    # but only for the subtree rooted at `tag`, skipping anything else.
+
+    def __init__(self, tag, fields=None):
+        self.tag = tag
+        self.fields = fields
+        self.result = None
+
+        self._stack = []
+        self._skip = 0
+
+    def start(self, name, attrs):
+        if self._skip:
+            self._skip += 1
+            return
+
+        if not self._stack:
+            if name != self.tag:
+                return
+
+        elif (
+            self.fields is not None
+            and len(self._stack) == 1
+            and name not in self.fields
+        ):
+            self._skip = 1
+            return
+
+        item = {"@" + k: v for (k, v) in attrs.items()} if attrs else None
+        self._stack.append([name, item, []])
+
+    def end(self, name):
+        if self._skip:
+            self._skip -= 1
+            return
+
+        if not self._stack:
+            return
+
+        name, item, text = self._stack.pop()
+        text = "".join(text).strip() or None
+        if item is None:
+            value = text
+        else:
+            if text is not None:
+                item["#text"] = text
+            value = item
+
+        if not self._stack:
+            self.result = value
+            raise _Done()
+
+        parent = self._stack[-1]
+        if parent[1] is None:
+            parent[1] = {}
+
+        siblings = parent[1]
+        if name not in siblings:
+            siblings[name] = value
+        elif isinstance(siblings[name], list):
+            siblings[name].append(value)
+        else:
+            siblings[name] = [siblings[name], value]
+
+    def data(self, data):
+        if self._stack and not self._skip:
+            self._stack[-1][2].append(data)
+
+
+def parse_element(body, tag, fields=None):
+    handler = _ResponseHandler(tag, fields=fields)
+
+    parser = xml.parsers.expat.ParserCreate()
+    parser.buffer_text = True
+    parser.StartElementHandler = handler.start
+    parser.EndElementHandler = handler.end
+    parser.CharacterDataHandler = handler.data
+
+    try:
+        parser.Parse(body, True)
+    except _Done:
+        pass
+
+    return handler.result
+
+
+def parse_response(body, method, fields=None):
+    if fields is not None:
+        fields = frozenset(fields) | {f"{method}Result"}
+
+    return parse_element(body, f"{method}Response", fields=fields)
+
+
+class _ElementsHandler:
+    # Collects elements named in `tags`, wherever they are, as they are
+    # closed: leaf elements as their text, others as a flat dict with the
+    # text of their direct children (only `fields`, if given). Nothing else
+    # is kept.
+
+    def __init__(self, tags, fields=None):
+        self.tags = tags
+        self.fields = fields
+        self.items = []
+
+        self._current = None
+        self._child = None
+        self._depth = 0
+
+    def start(self, name, attrs):
+        if self._current is None:
+            if name in self.tags:
+                self._current = [name, None, []]
+                self._depth = 0
+            return
+
+        self._depth += 1
+        if self._depth == 1:
+            if self._current[1] is None:
+                self._current[1] = {}
+            if self.fields is None or name in self.fields:
+                self._child = [name, []]
+
+    def end(self, name):
+        if self._current is None:
+            return
+
+        if self._depth == 0:
+            name, children, text = self._current
+            if children is None:
+                children = "".join(text).strip() or None
+            self.items.append((name, children))
+            self._current = None
+            return
+
+        if self._depth == 1 and self._child is not None:
+            child, text = self._child
+            self._current[1][child] = "".join(text).strip() or None
+            self._child = None
+
+        self._depth -= 1
+
+    def data(self, data):
+        if self._current is None:
+            return
+
+        if self._depth == 0:
+            self._current[2].append(data)
+        elif self._depth == 1 and self._child is not None:
+            self._child[1].append(data)
+
+
+def iter_elements(body, tags, fields=None, chunk_size=16384):
+    # Incremental alternative to parse_element for long lists: items are
+    # yielded as the body is parsed, ex. for GetClientInfo:
+    #
+    #   iter_elements(body, {"GetClientInfoResult", "ClientInfo"})
+    #
+    # yields ("GetClientInfoResult", "OK") and then one
+    # ("ClientInfo", {"MacAddress": ..., ...}) per client.
+    handler = _ElementsHandler(frozenset(tags), fields=fields)
+
+    parser = xml.parsers.expat.ParserCreate()
+    parser.buffer_text = True
+    parser.StartElementHandler = handler.start
+    parser.EndElementHandler = handler.end
+    parser.CharacterDataHandler = handler.data
+
+    for offset in range(0, len(body), chunk_size):
+        parser.Parse(body[offset : offset + chunk_size], False)
+        items, handler.items = handler.items, []
+        yield from items
+
+    parser.Parse(body[:0], True)
+    yield from handler.items
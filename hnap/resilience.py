@@ -0,0 +1,163 @@
+#
+# Copyright (C) 2021 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import logging
+import random
+import threading
+import time
+from enum import Enum
+
+from .const import (
+    DEFAULT_BREAKER_FAILURE_THRESHOLD,
+    DEFAULT_BREAKER_MAX_RESET_TIMEOUT,
+    DEFAULT_BREAKER_PROBE_TIMEOUT,
+    DEFAULT_BREAKER_RESET_TIMEOUT,
+    DEFAULT_RETRY_ATTEMPTS,
+    DEFAULT_RETRY_BACKOFF,
+    DEFAULT_RETRY_MAX_BACKOFF,
+)
+from .soapclient import CircuitOpenError
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class CircuitState(Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+
+class CircuitBreaker:
+    # Fails fast while a device is unhealthy. After failure_threshold
+    # consecutive failures (transport errors or 5xx responses) requests are
+    # rejected with CircuitOpenError for reset_timeout seconds. Then a single
+    # request is let through as a probe, with a short timeout: success closes
+    # the circuit, failure opens it again doubling reset_timeout up to
+    # max_reset_timeout.
+
+    def __init__(
+        self,
+        failure_threshold=DEFAULT_BREAKER_FAILURE_THRESHOLD,
+        reset_timeout=DEFAULT_BREAKER_RESET_TIMEOUT,
+        max_reset_timeout=DEFAULT_BREAKER_MAX_RESET_TIMEOUT,
+        probe_timeout=DEFAULT_BREAKER_PROBE_TIMEOUT,
+        name=None,
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.probe_timeout = probe_timeout
+        self.name = name
+
+        self._state = CircuitState.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._open_timeout = reset_timeout
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if (
+                self._state is CircuitState.OPEN
+                and time.monotonic() - self._opened_at >= self._open_timeout
+            ):
+                return CircuitState.HALF_OPEN
+
+            return self._state
+
+    def acquire(self):
+        # Returns True if the request is the half-open probe
+        with self._lock:
+            if self._state is CircuitState.CLOSED:
+                return False
+
+            remaining = self._opened_at + self._open_timeout - time.monotonic()
+            if self._probing or remaining > 0:
+                raise CircuitOpenError(
+                    f"{self.name or 'device'}: circuit open "
+                    f"(retry in {max(remaining, 0):.1f}s)"
+                )
+
+            self._state = CircuitState.HALF_OPEN
+            self._probing = True
+            return True
+
+    def record(self, success, probe=False):
+        # probe is the value returned by acquire() for that request. Requests
+        # started before the circuit opened don't decide anything, only the
+        # probe does.
+        with self._lock:
+            if probe:
+                self._probing = False
+            elif self._state is not CircuitState.CLOSED:
+                return
+
+            if success:
+                if self._state is not CircuitState.CLOSED:
+                    _LOGGER.info(f"{self.name}: circuit closed")
+                self._state = CircuitState.CLOSED
+                self._failures = 0
+                self._open_timeout = self.reset_timeout
+                return
+
+            self._failures += 1
+            if probe:
+                self._open_timeout = min(self._open_timeout * 2, self.max_reset_timeout)
+            elif self._failures < self.failure_threshold:
+                return
+
+            self._state = CircuitState.OPEN
+            self._opened_at = time.monotonic()
+            _LOGGER.info(
+                f"{self.name}: circuit open for {self._open_timeout:g}s "
+                f"after {self._failures} failures"
+            )
+
+    def reset(self):
+        with self._lock:
+            self._state = CircuitState.CLOSED
+            self._failures = 0
+            self._open_timeout = self.reset_timeout
+            self._probing = False
+
+
+class Retry:
+    # Bounded retry for transient connection errors. Errors where the request
+    # never left (connection refused, unreachable host) are always retried,
+    # errors where it may have reached the device (connection dropped) only
+    # for read-only Get* methods, so Set* actions never run twice. Timeouts
+    # are not retried: a device that does not answer in time is not going to
+    # do it better a few milliseconds later. Delays use exponential backoff
+    # with full jitter. Sync and async clients follow the same rules.
+
+    def __init__(
+        self,
+        attempts=DEFAULT_RETRY_ATTEMPTS,
+        backoff=DEFAULT_RETRY_BACKOFF,
+        max_backoff=DEFAULT_RETRY_MAX_BACKOFF,
+    ):
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def delays(self):
+        for n in range(self.attempts - 1):
+            yield random.uniform(0, min(self.max_backoff, self.backoff * 2**n))
@@ -0,0 +1,242 @@
+#
+# Copyright (C) 2021 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import concurrent.futures
+import heapq
+import itertools
+import logging
+import queue
+import random
+import threading
+import time
+from typing import Any, NamedTuple
+
+from .const import (
+    DEFAULT_SCHEDULER_JITTER,
+    DEFAULT_SCHEDULER_MAX_PER_HOST,
+    DEFAULT_SCHEDULER_WORKERS,
+)
+from .helpers import auth_required
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class Result(NamedTuple):
+    job: "Job"
+    value: Any
+    error: BaseException | None
+    started: float
+    elapsed: float
+
+
+@auth_required
+def _call(device, method, **params):
+    # Device.call() doesn't log in by itself, the typed getters do
+    return device.call(method, **params)
+
+
+class Job:
+    def __init__(self, device, method, interval, priority=0, callback=None, **params):
+        self.device = device
+        self.method = method
+        self.interval = interval
+        self.priority = priority
+        self.callback = callback
+        self.params = params
+
+        client = getattr(device, "client", device)
+        self.host = f"{client.hostname}:{client.port}"
+
+        self.next_run = 0.0
+        self.running = False
+        self.cancelled = False
+        self.runs = 0
+        self.skipped = 0
+
+    def __repr__(self):
+        name = self.method if isinstance(self.method, str) else self.method.__name__
+        return f"<Job {self.host} {name} every {self.interval}s>"
+
+    def execute(self):
+        if isinstance(self.method, str):
+            return _call(self.device, self.method, **self.params)
+
+        return self.method(**self.params)
+
+
+class Scheduler:
+    # Runs registered jobs periodically in a thread pool. Jobs are spread
+    # with jitter, higher priority jobs go first when capacity is scarce and
+    # a job still running when its next tick arrives skips that tick.
+
+    def __init__(
+        self,
+        max_workers=DEFAULT_SCHEDULER_WORKERS,
+        max_per_host=DEFAULT_SCHEDULER_MAX_PER_HOST,
+        jitter=DEFAULT_SCHEDULER_JITTER,
+        results=None,
+    ):
+        self.max_workers = max_workers
+        self.max_per_host = max_per_host
+        self.jitter = jitter
+        self.results = queue.Queue() if results is None else results
+
+        self._cond = threading.Condition()
+        self._heap = []
+        self._ready = []
+        self._seq = itertools.count()
+        self._in_flight = 0
+        self._host_in_flight = {}
+
+        self._executor = None
+        self._thread = None
+        self._stopped = True
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    def register(self, device, method, interval, priority=0, callback=None, **params):
+        job = Job(
+            device, method, interval, priority=priority, callback=callback, **params
+        )
+
+        with self._cond:
+            # Spread the first run over the whole interval
+            self._push(job, time.monotonic() + random.uniform(0, interval))
+            self._cond.notify()
+
+        return job
+
+    def unregister(self, job):
+        with self._cond:
+            job.cancelled = True
+            if job in self._ready:
+                self._ready.remove(job)
+
+    def start(self):
+        with self._cond:
+            if not self._stopped:
+                return
+
+            self._stopped = False
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="hnap-scheduler"
+            )
+            self._thread = threading.Thread(
+                target=self._run, name="hnap-scheduler", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self, wait=True):
+        with self._cond:
+            if self._stopped:
+                return
+
+            self._stopped = True
+            self._cond.notify()
+
+        self._thread.join()
+        self._executor.shutdown(wait=wait)
+
+    def _push(self, job, when):
+        job.next_run = when
+        heapq.heappush(self._heap, (when, next(self._seq), job))
+
+    def _reschedule(self, job, now):
+        jitter = random.uniform(-self.jitter, self.jitter) * job.interval
+        when = job.next_run + job.interval + jitter
+        # Don't try to catch up with missed ticks
+        self._push(job, max(when, now))
+
+    def _run(self):
+        with self._cond:
+            while not self._stopped:
+                now = time.monotonic()
+
+                while self._heap and self._heap[0][0] <= now:
+                    _, _, job = heapq.heappop(self._heap)
+                    if job.cancelled:
+                        continue
+
+                    if job.running or job in self._ready:
+                        job.skipped += 1
+                        _LOGGER.debug(f"{job}: previous run in flight, skipping")
+                    else:
+                        self._ready.append(job)
+
+                    self._reschedule(job, now)
+
+                self._dispatch()
+
+                timeout = self._heap[0][0] - now if self._heap else None
+                self._cond.wait(timeout)
+
+    def _dispatch(self):
+        self._ready.sort(key=lambda job: (-job.priority, job.next_run))
+
+        for job in list(self._ready):
+            if self._in_flight >= self.max_workers:
+                break
+
+            if self._host_in_flight.get(job.host, 0) >= self.max_per_host:
+                continue
+
+            self._ready.remove(job)
+            job.running = True
+            self._in_flight += 1
+            self._host_in_flight[job.host] = self._host_in_flight.get(job.host, 0) + 1
+            self._executor.submit(self._execute, job)
+
+    def _execute(self, job):
+        started = time.monotonic()
+        value, error = None, None
+
+        try:
+            value = job.execute()
+        except Exception as e:
+            error = e
+
+        result = Result(job, value, error, started, time.monotonic() - started)
+
+        try:
+            if job.callback is not None:
+                job.callback(result)
+            else:
+                self.results.put(result)
+
+        except Exception:
+            _LOGGER.exception(f"{job}: error delivering result")
+
+        with self._cond:
+            job.running = False
+            job.runs += 1
+            self._in_flight -= 1
+            self._host_in_flight[job.host] -= 1
+            if not self._host_in_flight[job.host]:
+                del self._host_in_flight[job.host]
+
+            self._cond.notify()
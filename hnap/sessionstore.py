@@ -0,0 +1,244 @@
+#
+# Copyright (C) 2021 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import abc
+import contextlib
+import json
+import logging
+import os
+import pathlib
+import tempfile
+import threading
+import time
+
+_LOGGER = logging.getLogger(__name__)
+
+# Everything needed to sign requests again. The password is never stored.
+SESSION_KEYS = ["challenge", "cookie", "private_key", "public_key", "result"]
+
+
+class SessionStoreError(Exception):
+    pass
+
+
+def session_key(hostname, port, username):
+    return f"{username}@{hostname}:{port}"
+
+
+def _secure_file(path):
+    path = pathlib.Path(path)
+    path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    if not path.exists():
+        os.close(os.open(path, os.O_CREAT | os.O_WRONLY, 0o600))
+
+    os.chmod(path, 0o600)
+    return path
+
+
+class SessionStore(abc.ABC):
+    @abc.abstractmethod
+    def load(self, key):
+        ...
+
+    @abc.abstractmethod
+    def save(self, key, session):
+        ...
+
+    @abc.abstractmethod
+    def delete(self, key):
+        ...
+
+
+class MemorySessionStore(SessionStore):
+    def __init__(self):
+        self._sessions = {}
+
+    def load(self, key):
+        return self._sessions.get(key)
+
+    def save(self, key, session):
+        self._sessions[key] = dict(session)
+
+    def delete(self, key):
+        self._sessions.pop(key, None)
+
+
+class FileSessionStore(SessionStore):
+    # Sessions are kept in memory and the file is only read again when
+    # another process changes it. Writes hold an flock on a sibling lock file,
+    # the data file itself is replaced on each write and can't be locked.
+    def __init__(self, path):
+        self._path = pathlib.Path(path)
+        self._lock = threading.Lock()
+        self._sessions = None
+        self._signature = None
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def _lock_path(self):
+        return self._path.with_name(self._path.name + ".lock")
+
+    def _stat(self):
+        try:
+            st = os.stat(self._path)
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            _LOGGER.warning(f"Unable to read session store {self._path}: {e}")
+            return None
+
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def _read(self):
+        signature = self._stat()
+        if self._sessions is not None and signature == self._signature:
+            return self._sessions
+
+        try:
+            sessions = json.loads(self._path.read_text()) if signature else {}
+
+        except FileNotFoundError:
+            sessions = {}
+
+        except (OSError, ValueError) as e:
+            _LOGGER.warning(f"Unable to read session store {self._path}: {e}")
+            sessions = {}
+
+        self._sessions, self._signature = sessions, signature
+        return sessions
+
+    def _write(self, sessions):
+        try:
+            self._path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+            # mkstemp creates files with 0600 permissions, replace is atomic
+            fd, tmp = tempfile.mkstemp(dir=self._path.parent, prefix=".hnap-")
+        except OSError as e:
+            raise SessionStoreError(e) from e
+
+        try:
+            with os.fdopen(fd, "w") as fh:
+                json.dump(sessions, fh)
+            os.replace(tmp, self._path)
+
+        except OSError as e:
+            os.unlink(tmp)
+            raise SessionStoreError(e) from e
+
+        self._sessions, self._signature = sessions, self._stat()
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        try:
+            import fcntl
+        except ImportError:
+            # Not available on Windows, only threads are serialized there
+            yield
+            return
+
+        try:
+            self._path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+            fd = os.open(self._lock_path, os.O_CREAT | os.O_RDWR, 0o600)
+        except OSError as e:
+            raise SessionStoreError(e) from e
+
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    def load(self, key):
+        with self._lock:
+            return self._read().get(key)
+
+    def save(self, key, session):
+        session = dict(session)
+        with self._lock, self._file_lock():
+            sessions = self._read()
+            if sessions.get(key) == session:
+                return
+
+            self._write({**sessions, key: session})
+
+    def delete(self, key):
+        with self._lock, self._file_lock():
+            sessions = self._read()
+            if key in sessions:
+                self._write({k: v for k, v in sessions.items() if k != key})
+
+
+class SQLiteSessionStore(SessionStore):
+    def __init__(self, path):
+        try:
+            self._path = _secure_file(path)
+        except OSError as e:
+            raise SessionStoreError(e) from e
+
+        self._lock = threading.Lock()
+        self._execute(
+            "CREATE TABLE IF NOT EXISTS sessions "
+            "(key TEXT PRIMARY KEY, data TEXT NOT NULL, updated REAL NOT NULL)"
+        )
+
+    @property
+    def path(self):
+        return self._path
+
+    def _connect(self):
+        import sqlite3
+
+        return sqlite3.connect(self._path, timeout=10)
+
+    def _execute(self, *args):
+        # Imported here, most users never need it and it's not free
+        import sqlite3
+
+        with self._lock:
+            try:
+                conn = self._connect()
+                try:
+                    with conn:
+                        return conn.execute(*args).fetchone()
+                finally:
+                    conn.close()
+
+            except sqlite3.Error as e:
+                raise SessionStoreError(e) from e
+
+    def load(self, key):
+        row = self._execute("SELECT data FROM sessions WHERE key = ?", (key,))
+        if row is None:
+            return None
+
+        try:
+            return json.loads(row[0])
+        except ValueError:
+            return None
+
+    def save(self, key, session):
+        self._execute(
+            "INSERT OR REPLACE INTO sessions (key, data, updated) VALUES (?, ?, ?)",
+            (key, json.dumps(session), time.time()),
+        )
+
+    def delete(self, key):
+        self._execute("DELETE FROM sessions WHERE key = ?", (key,))
@@ -0,0 +1,668 @@
+#
+# Copyright (C) 2021 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+# Local stand-in for HNAP devices. Implements the Login challenge/HMAC flow
+# and a few canned actions, enough to exercise clients and device classes
+# without real hardware.
+#
+# A single process can serve thousands of devices, each one on its own port
+# or on its own loopback address (Linux routes the whole 127.0.0.0/8 range to
+# lo). Faults, session expiry and motion can be scripted per device.
+#
+#   python -m hnap.simulator --motion 2000 --siren 1000 --addresses
+
+import argparse
+import asyncio
+import bisect
+import collections
+import ipaddress
+import json
+import logging
+import random
+import secrets
+import threading
+import time
+from enum import Enum
+from xml.sax.saxutils import escape
+
+from .const import DEFAULT_MODULE_ID, DEFAULT_MOTION_BACKOFF, DEFAULT_USERNAME
+from .devices import Camera, Motion, Router, Siren, Water
+from .parser import parse_element
+from .soapclient import BaseSoapClient, hex_hmac_md5
+
+_LOGGER = logging.getLogger(__name__)
+
+XMLNS = BaseSoapClient.HNAP1_XMLNS
+LOGIN_METHOD = BaseSoapClient.HNAP_LOGIN_METHOD
+
+# Shared by every device when each one has its own address, unprivileged so
+# no root is needed
+ADDRESSES_DEFAULT_PORT = 8080
+
+HTTP_REASONS = {
+    200: "OK",
+    401: "Unauthorized",
+    404: "Not Found",
+    500: "Internal Server Error",
+}
+
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+def raise_fd_limit():
+    # Each device takes a listening socket plus one per open connection,
+    # default soft limits fall short for large fleets
+    if resource is None:
+        return None
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    for limit in (hard, 1 << 20, 1 << 16):
+        if hard != resource.RLIM_INFINITY and limit > hard:
+            continue
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (limit, hard))
+            return limit
+        except (ValueError, OSError):
+            pass
+
+    return soft
+
+
+def loopback_addresses(count, start=2):
+    base = int(ipaddress.IPv4Address("127.0.0.0"))
+    return [str(ipaddress.IPv4Address(base + start + idx)) for idx in range(count)]
+
+
+def _render_fields(fields):
+    ret = []
+
+    for name, value in fields.items():
+        values = value if isinstance(value, list) else [value]
+        for value in values:
+            if value is None:
+                ret.append(f"<{name}></{name}>")
+            elif isinstance(value, dict):
+                ret.append(f"<{name}>{_render_fields(value)}</{name}>")
+            else:
+                ret.append(f"<{name}>{escape(str(value))}</{name}>")
+
+    return "".join(ret)
+
+
+def _cookie(headers):
+    return headers.get("cookie", "").partition("uid=")[2]
+
+
+def render_response(method, fields):
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>'
+        "<soap:Envelope "
+        'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+        'xmlns:xsd="http://www.w3.org/2001/XMLSchema" '
+        'xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/">'
+        "<soap:Body>"
+        f'<{method}Response xmlns="{XMLNS}">'
+        f"{_render_fields(fields)}"
+        f"</{method}Response>"
+        "</soap:Body>"
+        "</soap:Envelope>"
+    ).encode()
+
+
+class Fault(Enum):
+    ERROR = "error"
+    TIMEOUT = "timeout"
+
+
+class VirtualDevice:
+    DEVICE_TYPE = "Sensor"
+    MODEL_NAME = "DCH-VIRTUAL"
+    MODULE_TYPES = []
+    FIRMWARE_VERSION = "1.00"
+
+    def __init__(
+        self,
+        password,
+        username=DEFAULT_USERNAME,
+        latency=0.0,
+        name=None,
+        error_rate=0.0,
+        timeout_rate=0.0,
+        session_lifetime=None,
+        seed=None,
+    ):
+        self.password = password
+        self.username = username
+        self.latency = latency
+        self.name = name or self.MODEL_NAME
+
+        # Faults: a stuck device accepts connections but never answers
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.stuck = False
+        self.session_lifetime = session_lifetime
+
+        self.sessions = {}
+        self.logins = 0
+        self.calls = collections.Counter()
+        self.faults = collections.Counter()
+
+        self._pending = {}
+        self._random = random.Random(seed)
+
+    @property
+    def actions(self):
+        return sorted(
+            [LOGIN_METHOD] + [x[7:] for x in dir(self) if x.startswith("action_")]
+        )
+
+    @property
+    def module_actions(self):
+        return [
+            x
+            for x in self.actions
+            if x != LOGIN_METHOD and not hasattr(VirtualDevice, f"action_{x}")
+        ]
+
+    def fault(self):
+        if self.stuck:
+            fault = Fault.TIMEOUT
+        else:
+            x = self._random.random()
+            if x < self.timeout_rate:
+                fault = Fault.TIMEOUT
+            elif x < self.timeout_rate + self.error_rate:
+                fault = Fault.ERROR
+            else:
+                return None
+
+        self.faults[fault] += 1
+        return fault
+
+    def expire_sessions(self):
+        self.sessions.clear()
+
+    def handle_get(self):
+        # Real devices describe themselves to anyone asking
+        fields = {"GetDeviceSettingsResult": "OK", **self.action_GetDeviceSettings({})}
+        return 200, render_response("GetDeviceSettings", fields)
+
+    def handle(self, headers, body):
+        soap_action = headers.get("soapaction", "")
+        action = soap_action.strip('"')
+        if not action.startswith(XMLNS):
+            return 500, b""
+
+        method = action[len(XMLNS) :]
+        params = parse_element(body, method) or {}
+        self.calls[method] += 1
+
+        if method == LOGIN_METHOD:
+            return 200, render_response(method, self._login(headers, params))
+
+        if not self._is_authorized(headers, soap_action):
+            return 401, b""
+
+        handler = getattr(self, f"action_{method}", None)
+        fields = handler(params) if handler else {f"{method}Result": "ERROR"}
+        if f"{method}Result" not in fields:
+            fields = {f"{method}Result": "OK", **fields}
+
+        return 200, render_response(method, fields)
+
+    def _login(self, headers, params):
+        if params.get("Username") != self.username:
+            return {"LoginResult": "failed"}
+
+        if params.get("Action") == "request":
+            cookie = secrets.token_hex(5).upper()
+            challenge = secrets.token_hex(10).upper()
+            public_key = secrets.token_hex(10).upper()
+            private_key = hex_hmac_md5(public_key + self.password, challenge).upper()
+            self._pending[cookie] = (private_key, challenge)
+
+            return {
+                "LoginResult": "OK",
+                "Challenge": challenge,
+                "Cookie": cookie,
+                "PublicKey": public_key,
+            }
+
+        cookie = _cookie(headers)
+        if cookie not in self._pending:
+            return {"LoginResult": "failed"}
+
+        private_key, challenge = self._pending.pop(cookie)
+        if params.get("LoginPassword") != hex_hmac_md5(private_key, challenge).upper():
+            return {"LoginResult": "failed"}
+
+        self.sessions[cookie] = (private_key, time.monotonic())
+        self.logins += 1
+        return {"LoginResult": "success"}
+
+    def _is_authorized(self, headers, soap_action):
+        cookie = _cookie(headers)
+        session = self.sessions.get(cookie)
+        if session is None:
+            return False
+
+        if (
+            self.session_lifetime is not None
+            and time.monotonic() - session[1] > self.session_lifetime
+        ):
+            del self.sessions[cookie]
+            return False
+
+        try:
+            auth, time_stamp = headers.get("hnap_auth", "").split()
+        except ValueError:
+            return False
+
+        return auth == hex_hmac_md5(session[0], time_stamp + soap_action).upper()
+
+    def action_GetDeviceSettings(self, params):
+        return {
+            "Type": self.DEVICE_TYPE,
+            "DeviceName": self.name,
+            "VendorName": "D-Link",
+            "ModelName": self.MODEL_NAME,
+            "FirmwareVersion": self.FIRMWARE_VERSION,
+            "HardwareVersion": "A1",
+            "SOAPActions": {"string": [XMLNS + x for x in self.actions]},
+            "ModuleTypes": {"string": self.MODULE_TYPES},
+        }
+
+    def action_GetModuleSOAPActions(self, params):
+        return {
+            "ModuleSOAPList": {
+                "ModuleID": params.get("ModuleID", DEFAULT_MODULE_ID),
+                "SOAPActions": {"Action": self.module_actions},
+            }
+        }
+
+
+class VirtualCamera(VirtualDevice):
+    DEVICE_TYPE = "Camera"
+    MODEL_NAME = "DCS-8000LH"
+    MODULE_TYPES = [Camera.MODULE_TYPE]
+
+
+class VirtualMotion(VirtualDevice):
+    MODEL_NAME = "DCH-S150"
+    MODULE_TYPES = [Motion.MODULE_TYPE]
+
+    def __init__(
+        self, *args, backoff=DEFAULT_MOTION_BACKOFF, script=(), period=None, **kwargs
+    ):
+        # script: detection times, in seconds since creation. period: detect
+        # motion periodically, with a random phase so a fleet does not fire
+        # all at once.
+        super().__init__(*args, **kwargs)
+        self.backoff = backoff
+        self.script = sorted(script)
+        self.period = period
+
+        self._started = time.time()
+        self._phase = self._random.uniform(0, period) if period else 0
+        self._triggered = self._started - 10 * backoff
+
+    @property
+    def latest_detection(self):
+        ret = self._triggered
+        elapsed = time.time() - self._started
+
+        idx = bisect.bisect_right(self.script, elapsed)
+        if idx:
+            ret = max(ret, self._started + self.script[idx - 1])
+
+        if self.period and elapsed >= self._phase:
+            periods = (elapsed - self._phase) // self.period
+            ret = max(ret, self._started + self._phase + periods * self.period)
+
+        return int(ret)
+
+    def trigger(self):
+        self._triggered = time.time()
+
+    def action_GetMotionDetectorSettings(self, params):
+        return {
+            "ModuleID": params.get("ModuleID", DEFAULT_MODULE_ID),
+            "Sensitivity": 80,
+            "OPStatus": "true",
+            "Backoff": self.backoff,
+        }
+
+    def action_GetLatestDetection(self, params):
+        return {
+            "ModuleID": params.get("ModuleID", DEFAULT_MODULE_ID),
+            "LatestDetectTime": self.latest_detection,
+        }
+
+
+class VirtualSiren(VirtualDevice):
+    DEVICE_TYPE = "Siren"
+    MODEL_NAME = "DCH-S220"
+    MODULE_TYPES = [Siren.MODULE_TYPE]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sound_type = 1
+        self.volume = 100
+        self.duration = 60
+        self.sounding_until = 0
+
+    @property
+    def is_sounding(self):
+        return time.monotonic() < self.sounding_until
+
+    def action_GetSirenAlarmSettings(self, params):
+        return {
+            "ModuleID": params.get("ModuleID", DEFAULT_MODULE_ID),
+            "SoundType": self.sound_type,
+            "Volume": self.volume,
+            "Duration": self.duration,
+            "IsSounding": "true" if self.is_sounding else "false",
+        }
+
+    def action_SetSoundPlay(self, params):
+        try:
+            self.sound_type = int(params["SoundType"])
+            self.volume = int(params["Volume"])
+            self.duration = int(params["Duration"])
+        except (KeyError, TypeError, ValueError):
+            return {"SetSoundPlayResult": "ERROR"}
+
+        self.sounding_until = time.monotonic() + self.duration
+        return {}
+
+    def action_SetAlarmDismissed(self, params):
+        self.sounding_until = 0
+        return {}
+
+
+class VirtualWater(VirtualDevice):
+    MODEL_NAME = "DCH-S160"
+    MODULE_TYPES = [Water.MODULE_TYPE]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.is_water = False
+
+    def action_GetWaterDetectorState(self, params):
+        return {
+            "ModuleID": params.get("ModuleID", DEFAULT_MODULE_ID),
+            "IsWater": "true" if self.is_water else "false",
+        }
+
+
+class VirtualRouter(VirtualDevice):
+    DEVICE_TYPE = "Router"
+    MODEL_NAME = "DIR-842"
+    MODULE_TYPES = [Router.MODULE_TYPE]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # MAC -> dict with DeviceName, NickName and Type ("OFFLINE" or a
+        # connection type)
+        self.clients = {}
+
+    def connect(self, mac, name="", nickname="", type="WiFi_2.4G"):
+        self.clients[mac] = {"DeviceName": name, "NickName": nickname, "Type": type}
+
+    def disconnect(self, mac):
+        self.clients[mac]["Type"] = "OFFLINE"
+
+    def action_GetClientInfo(self, params):
+        return {
+            "ClientInfoLists": {
+                "ClientInfo": [
+                    {"MacAddress": mac, "IPv4Address": "", **client}
+                    for mac, client in self.clients.items()
+                ]
+            }
+        }
+
+
+DEVICE_CLASSES = {
+    "camera": VirtualCamera,
+    "motion": VirtualMotion,
+    "router": VirtualRouter,
+    "siren": VirtualSiren,
+    "water": VirtualWater,
+}
+
+
+class Simulator:
+    # Serves virtual devices over HTTP from an event loop running in a
+    # background thread, each device on its own address and port.
+
+    def __init__(self, host="127.0.0.1"):
+        self.host = host
+        self.devices = {}
+
+        self._loop = None
+        self._thread = None
+        self._servers = []
+        self._connections = {}
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        ready = threading.Event()
+
+        def _run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.call_soon(ready.set)
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=_run, name="hnap-simulator", daemon=True)
+        self._thread.start()
+        ready.wait()
+
+    def stop(self):
+        async def _close():
+            for server in self._servers:
+                server.close()
+            for server in self._servers:
+                await server.wait_closed()
+
+            # Closing the transport ends the handler loop, cancelling the
+            # handler tasks makes asyncio.streams log spurious errors
+            for writer in self._connections.values():
+                writer.close()
+            await asyncio.gather(*self._connections, return_exceptions=True)
+
+        self._run(_close())
+        self._servers = []
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def add(self, device, port=0, address=None):
+        address = address or self.host
+
+        async def _start_server():
+            return await asyncio.start_server(
+                lambda r, w: self._handle(device, r, w), address, port
+            )
+
+        server = self._run(_start_server())
+        self._servers.append(server)
+
+        port = server.sockets[0].getsockname()[1]
+        self.devices[(address, port)] = device
+        return port
+
+    async def _handle(self, device, reader, writer):
+        task = asyncio.current_task()
+        self._connections[task] = writer
+
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                fault = device.fault()
+                if fault is Fault.TIMEOUT:
+                    # Hold the connection until the client gives up or the
+                    # simulator is stopped
+                    await reader.read()
+                    break
+
+                if device.latency:
+                    await asyncio.sleep(device.latency)
+
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                if fault is Fault.ERROR:
+                    status, payload = 500, b""
+                elif method == "POST" and path == "/HNAP1/":
+                    status, payload = device.handle(headers, body)
+                elif method == "GET" and path == "/HNAP1/":
+                    status, payload = device.handle_get()
+                else:
+                    status, payload = 404, b""
+
+                writer.write(
+                    (
+                        f"HTTP/1.1 {status} {HTTP_REASONS[status]}\r\n"
+                        "Content-Type: text/xml; charset=utf-8\r\n"
+                        f"Content-Length: {len(payload)}\r\n"
+                        "\r\n"
+                    ).encode("latin-1")
+                    + payload
+                )
+                await writer.drain()
+
+                if headers.get("connection", "").lower() == "close":
+                    break
+
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+
+        finally:
+            self._connections.pop(task, None)
+            writer.close()
+
+
+def main():
+    logging.basicConfig()
+
+    parser = argparse.ArgumentParser(prog="python -m hnap.simulator")
+    for name in DEVICE_CLASSES:
+        parser.add_argument(
+            f"--{name}", type=int, default=0, metavar="N", help=f"{name} devices"
+        )
+    parser.add_argument("--password", default="123456")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument(
+        "--port", type=int, default=0, help="Port (default: a random one per device)"
+    )
+    parser.add_argument(
+        "--addresses",
+        action="store_true",
+        help=(
+            "Serve each device on its own loopback address (127.0.0.2 onwards), "
+            f"all of them on --port (default: {ADDRESSES_DEFAULT_PORT})"
+        ),
+    )
+    parser.add_argument("--latency", type=float, default=0.0, metavar="MS")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--timeout-rate", type=float, default=0.0)
+    parser.add_argument("--stuck-rate", type=float, default=0.0)
+    parser.add_argument("--session-lifetime", type=float, metavar="SECONDS")
+    parser.add_argument("--motion-period", type=float, metavar="SECONDS")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    if args.addresses and not args.port:
+        args.port = ADDRESSES_DEFAULT_PORT
+
+    rnd = random.Random(args.seed)
+    devices = []
+    for name, cls in DEVICE_CLASSES.items():
+        for _ in range(getattr(args, name)):
+            kwargs = {}
+            if cls is VirtualMotion:
+                kwargs["period"] = args.motion_period
+
+            device = cls(
+                args.password,
+                latency=args.latency / 1e3,
+                error_rate=args.error_rate,
+                timeout_rate=args.timeout_rate,
+                session_lifetime=args.session_lifetime,
+                seed=rnd.random(),
+                **kwargs,
+            )
+            device.stuck = rnd.random() < args.stuck_rate
+            devices.append((name, device))
+
+    raise_fd_limit()
+
+    addresses = [args.host] * len(devices)
+    if args.addresses:
+        addresses = loopback_addresses(len(devices))
+
+    with Simulator(host=args.host) as sim:
+        for (name, device), address in zip(devices, addresses):
+            port = sim.add(device, port=args.port, address=address)
+            print(
+                json.dumps(
+                    {
+                        "hostname": address,
+                        "port": port,
+                        "type": name,
+                        "stuck": device.stuck,
+                    }
+                ),
+                flush=True,
+            )
+
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
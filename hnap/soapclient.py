@@ -17,37 +17,172 @@
 # USA.
 
 
+import concurrent.futures
 import functools
 import hashlib
+import heapq
 import hmac
+import itertools
 import logging
+import threading
 import time
-import xml.dom.minidom
+import weakref
 
 import requests
-import xmltodict
+import requests.adapters
+from urllib3.exceptions import NewConnectionError
 
+from .capabilities import CapabilityCache, capability_key
 from .const import (
     DEFAULT_MODULE_ID,
+    DEFAULT_POOL_IDLE_TIMEOUT,
+    DEFAULT_POOL_SIZE,
     DEFAULT_PORT,
     DEFAULT_REQUEST_TIMEOUT,
     DEFAULT_SESSION_LIFETIME,
+    DEFAULT_SESSION_RENEW_MARGIN,
     DEFAULT_USERNAME,
 )
 from .helpers import auth_required
+from .parser import parse_response
+from .sessionstore import SESSION_KEYS, SessionStoreError, session_key
+from .singleflight import SingleFlight
+from .timeouts import Timeouts
 
 _LOGGER = logging.getLogger(__name__)
 
 
+def _is_read_only(method):
+    # HNAP getters have no side effects, anything else may change the device
+    return method.startswith("Get")
+
+
+def _connect_failed(error):
+    # Connection refused, unreachable host, name resolution... the request
+    # never left. Otherwise it may have reached the device.
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
 def hex_hmac_md5(a: str, b: str) -> str:
     return hmac.new(a.encode("ascii"), b.encode("ascii"), hashlib.md5).hexdigest()
 
 
-class SoapClient:
+class _MethodTemplate:
+    MAX_CACHED_ENVELOPES = 32
+
+    def __init__(self, xmlns, method, cacheable=True):
+        self.soap_action = f'"{xmlns}{method}"'
+        self.headers = {
+            "Content-Type": "text/xml; charset=utf-8",
+            "SOAPAction": self.soap_action,
+        }
+
+        self._prefix = (
+            '<?xml version="1.0" encoding="utf-8"?>'
+            "<soap:Envelope "
+            '  xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+            '  xmlns:xsd="http://www.w3.org/2001/XMLSchema" '
+            '  xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/">'
+            "  <soap:Body>"
+            f'   <{method} xmlns="{xmlns}">'
+            "     "
+        )
+        self._suffix = f"   </{method}>" "  </soap:Body>" "</soap:Envelope>"
+        self._envelopes = {} if cacheable else None
+
+    def _render(self, parameters):
+        parameters_xml = "\n".join(
+            [f"     <{k}>{v}</{k}>" for (k, v) in parameters.items()]
+        )
+        return (self._prefix + parameters_xml + self._suffix).encode("utf-8")
+
+    def build_envelope(self, parameters):
+        if self._envelopes is None:
+            return self._render(parameters)
+
+        try:
+            key = tuple(parameters.items())
+            return self._envelopes[key]
+        except TypeError:
+            return self._render(parameters)
+        except KeyError:
+            pass
+
+        if len(self._envelopes) >= self.MAX_CACHED_ENVELOPES:
+            self._envelopes.clear()
+
+        ret = self._envelopes[key] = self._render(parameters)
+        return ret
+
+
+@functools.lru_cache(maxsize=256)
+def _method_template(xmlns, method):
+    # Login envelopes carry credentials, don't keep them around
+    return _MethodTemplate(xmlns, method, cacheable=method != "Login")
+
+
+class _SessionRenewer:
+    # A single thread schedules renewals for every SoapClient in the process,
+    # logins run in a small pool so slow devices don't delay the rest.
+    MAX_WORKERS = 4
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._queue = []
+        self._seq = itertools.count()
+        self._thread = None
+        self._executor = None
+
+    def schedule(self, client, delay):
+        entry = (
+            time.monotonic() + delay,
+            next(self._seq),
+            weakref.ref(client),
+            client._authenticated,
+        )
+
+        with self._cond:
+            heapq.heappush(self._queue, entry)
+
+            if self._thread is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.MAX_WORKERS, thread_name_prefix="hnap-renew"
+                )
+                self._thread = threading.Thread(
+                    target=self._run, name="hnap-renewer", daemon=True
+                )
+                self._thread.start()
+
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue or self._queue[0][0] > time.monotonic():
+                    timeout = (
+                        self._queue[0][0] - time.monotonic() if self._queue else None
+                    )
+                    self._cond.wait(timeout)
+
+                _, _, ref, authenticated = heapq.heappop(self._queue)
+
+            client = ref()
+            if client is not None:
+                self._executor.submit(client._renew_session, authenticated)
+
+
+_RENEWER = _SessionRenewer()
+_SINGLE_FLIGHT = SingleFlight()
+
+
+class BaseSoapClient:
     HNAP1_XMLNS = "http://purenetworks.com/HNAP1/"
     HNAP_METHOD = "POST"
     HNAP_BODY_ENCODING = "UTF8"
     HNAP_LOGIN_METHOD = "Login"
+    HNAP_INVALID_SESSION_STATUS_CODES = (401, 403)
+    HNAP_INVALID_SESSION_RESULTS = ("unauthorized",)
     HNAP_AUTH = {
         "challenge": "",
         "cookie": "",
@@ -67,11 +202,35 @@ class SoapClient:
         port=DEFAULT_PORT,
         request_timeout=DEFAULT_REQUEST_TIMEOUT,
         session_lifetime=DEFAULT_SESSION_LIFETIME,
+        session_store=None,
+        renew_margin=DEFAULT_SESSION_RENEW_MARGIN,
+        capability_cache=None,
+        coalesce=True,
+        metrics=None,
+        circuit_breaker=None,
+        retry=None,
+        timeouts=None,
     ):
         self._hostname = hostname
         self._port = port
-        self._request_timeout = request_timeout
+        self._timeouts = (
+            Timeouts(connect=request_timeout, read=request_timeout)
+            if timeouts is None
+            else timeouts
+        )
         self._session_lifetime = session_lifetime
+        self._session_store = session_store
+        self._renew_margin = renew_margin
+        self._coalesce = coalesce
+        self._metrics = metrics
+        self._circuit_breaker = circuit_breaker
+        self._retry = retry
+        if circuit_breaker is not None and circuit_breaker.name is None:
+            circuit_breaker.name = hostname
+
+        self._capabilities = (
+            CapabilityCache() if capability_cache is None else capability_cache
+        )
 
         self.HNAP_AUTH = self.HNAP_AUTH.copy()
         self.HNAP_AUTH["url"] = self.HNAP_AUTH["url"].format(
@@ -81,6 +240,15 @@ class SoapClient:
         self.HNAP_AUTH["password"] = password
         self._authenticated = 0
 
+        self._signer = None
+        self._signatures = {}
+
+        # Restored sessions are trusted until the device rejects them.
+        # Subclasses restore them once fully initialized, a renewal may be
+        # due right away.
+        self._session_restored = False
+        self._used_since_login = False
+
     @property
     def hostname(self):
         return self._hostname
@@ -93,102 +261,118 @@ class SoapClient:
     def username(self):
         return self.HNAP_AUTH["username"]
 
+    @property
+    def capabilities(self):
+        return self._capabilities
+
+    @property
+    def _capability_key(self):
+        return capability_key(self.hostname, self.port)
+
     @property
     def password(self):
         return self.HNAP_AUTH["password"]
 
-    def _build_method_envelope(self, method, **parameters):
-        parameters_xml = "\n".join(
-            [f"     <{k}>{v}</{k}>" for (k, v) in parameters.items()]
-        )
-        return (
-            '<?xml version="1.0" encoding="utf-8"?>'
-            "<soap:Envelope "
-            '  xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
-            '  xmlns:xsd="http://www.w3.org/2001/XMLSchema" '
-            '  xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/">'
-            "  <soap:Body>"
-            f'   <{method} xmlns="{self.HNAP1_XMLNS}">'
-            f"     {parameters_xml}"
-            f"   </{method}>"
-            "  </soap:Body>"
-            "</soap:Envelope>"
+    def _coalesce_key(self, method, parameters):
+        if not self._coalesce or not _is_read_only(method):
+            return None
+
+        key = (
+            self.HNAP_AUTH["url"],
+            self.username,
+            method,
+            tuple(sorted(parameters.items())),
         )
+        try:
+            hash(key)
+        except TypeError:
+            return None
 
-    def _save_login_result(self, body):
-        doc = xml.dom.minidom.parseString(body)
-        self.HNAP_AUTH["result"] = doc.getElementsByTagName(
-            f"{self.HNAP_LOGIN_METHOD}Result"
-        )[0].firstChild.nodeValue
-
-        for tag, key in [
-            ("Challenge", "challenge"),
-            ("PublicKey", "public_key"),
-            ("Cookie", "cookie"),
-        ]:
-            elements = doc.getElementsByTagName(tag)
-            self.HNAP_AUTH[key] = elements[0].firstChild.nodeValue
-
-        self.HNAP_AUTH["private_key"] = hex_hmac_md5(
-            self.HNAP_AUTH["public_key"] + self.HNAP_AUTH["password"],
-            self.HNAP_AUTH["challenge"],
-        ).upper()
+        return key
 
-    def _getHNAP_auth(self, soap_action, private_key):
-        time_stamp = int(time.mktime(time.localtime()))
-        auth = hex_hmac_md5(private_key, str(time_stamp) + soap_action)
-        ret = auth.upper() + " " + str(time_stamp)
+    def _build_method_envelope(self, method, **parameters):
+        return _method_template(self.HNAP1_XMLNS, method).build_envelope(parameters)
 
+    def _build_call_request(self, method, parameters, auth=None):
+        if self._metrics is None:
+            return (
+                self._build_method_envelope(method, **parameters),
+                self._build_call_headers(method, auth=auth),
+            )
+
+        started = time.perf_counter()
+        ret = (
+            self._build_method_envelope(method, **parameters),
+            self._build_call_headers(method, auth=auth),
+        )
+        self._metrics.phase(self, method, "build", time.perf_counter() - started)
         return ret
 
-    def call_raw(self, method, **parameters):
-        req_url = self.HNAP_AUTH["url"]
-        req_method = self.HNAP_METHOD
-        req_headers = {
-            "Content-Type": "text/xml; charset=utf-8",
-            "SOAPAction": f'"{self.HNAP1_XMLNS}{method}"',
-            "HNAP_AUTH": self._getHNAP_auth(
-                f'"{self.HNAP1_XMLNS}{method}"',
-                self.HNAP_AUTH["private_key"],
-            ),
-            "Cookie": "uid=" + self.HNAP_AUTH["cookie"],
+    def _connection_used(self, state):
+        if self._metrics is not None:
+            self._metrics.connection(self, state)
+
+    def _request_timeouts(self, method, probe=False):
+        connect, read = self._timeouts.get(method)
+        if probe:
+            probe_timeout = self._circuit_breaker.probe_timeout
+            connect, read = min(connect, probe_timeout), min(read, probe_timeout)
+
+        return connect, read
+
+    def _save_login_result(self, body, auth=None):
+        auth = self.HNAP_AUTH if auth is None else auth
+        fields = {
+            "Challenge": "challenge",
+            "PublicKey": "public_key",
+            "Cookie": "cookie",
         }
 
-        resp = requests.request(
-            method=req_method,
-            url=req_url,
-            headers=req_headers,
-            data=self._build_method_envelope(method, **parameters),
-            timeout=self._request_timeout,
-        )
+        res = parse_response(body, self.HNAP_LOGIN_METHOD, fields=fields) or {}
+        auth["result"] = res[f"{self.HNAP_LOGIN_METHOD}Result"]
+        for tag, key in fields.items():
+            auth[key] = res[tag]
 
-        if resp.status_code != 200:
-            raise MethodCallError(
-                f"Invalid status code: {resp.status_code}", resp.status_code
+        auth["private_key"] = hex_hmac_md5(
+            auth["public_key"] + auth["password"],
+            auth["challenge"],
+        ).upper()
+
+    def _getHNAP_auth(self, soap_action, private_key):
+        time_stamp = int(time.time())
+
+        # Pollers send the same actions many times per second, signatures only
+        # change with the timestamp
+        cached = self._signatures.get(soap_action)
+        if cached and cached[0] == time_stamp and cached[1] == private_key:
+            return cached[2]
+
+        if self._signer is None or self._signer[0] != private_key:
+            self._signer = (
+                private_key,
+                hmac.new(private_key.encode("ascii"), digestmod=hashlib.md5),
             )
-        return resp.text
 
-    def call(self, method, **parameters):
-        parsed = xmltodict.parse(self.call_raw(method, **parameters))
-        try:
-            res = parsed["soap:Envelope"]["soap:Body"][f"{method}Response"][
-                f"{method}Result"
-            ]
-            if res.lower() not in ("ok", "success"):
-                raise MethodCallError(f"{method} returned {res}")
+        auth = self._signer[1].copy()
+        auth.update((str(time_stamp) + soap_action).encode("ascii"))
+        ret = auth.hexdigest().upper() + " " + str(time_stamp)
 
-        except KeyError:
-            raise MethodCallError(f"Missing {method}Result key")
+        self._signatures[soap_action] = (time_stamp, private_key, ret)
+        return ret
 
-        return parsed["soap:Envelope"]["soap:Body"][f"{method}Response"]
+    def _build_call_headers(self, method, auth=None):
+        auth = self.HNAP_AUTH if auth is None else auth
+        template = _method_template(self.HNAP1_XMLNS, method)
 
-    def authenticate(self, force=False):
-        if self.is_authenticated() and not force:
-            _LOGGER.debug("Client already authenticated")
-            return
+        headers = template.headers.copy()
+        headers["HNAP_AUTH"] = self._getHNAP_auth(
+            template.soap_action, auth["private_key"]
+        )
+        headers["Cookie"] = "uid=" + auth["cookie"]
 
-        url = self.HNAP_AUTH["url"]
-        method = self.HNAP_METHOD
+        return headers
+
+    def _build_login_request(self):
         data = self._build_method_envelope(
             self.HNAP_LOGIN_METHOD,
             Action="request",
@@ -196,50 +380,126 @@ class SoapClient:
             LoginPassword="",
             Captcha="",
         )
-        headers = {
-            "Content-Type": "text/xml; charset=utf-8",
-            "SOAPAction": '"' + self.HNAP1_XMLNS + self.HNAP_LOGIN_METHOD + '"',
-        }
+        headers = _method_template(
+            self.HNAP1_XMLNS, self.HNAP_LOGIN_METHOD
+        ).headers.copy()
 
-        resp = requests.request(
-            method=method,
-            url=url,
-            data=data,
-            headers=headers,
-            timeout=self._request_timeout,
-        )
+        return data, headers
 
-        if resp.status_code != 200:
-            raise AuthenticationError(
-                f"Invalid response while login: {resp.status_code} ({resp.text})"
-            )
-
-        self._save_login_result(resp.text)
-
-        # Phase 2
-        login_password = hex_hmac_md5(
-            self.HNAP_AUTH["private_key"], self.HNAP_AUTH["challenge"]
-        ).upper()
+    def _build_login_parameters(self, auth=None):
+        auth = self.HNAP_AUTH if auth is None else auth
+        login_password = hex_hmac_md5(auth["private_key"], auth["challenge"]).upper()
 
-        res = self.call(
-            self.HNAP_LOGIN_METHOD,
+        return dict(
             Action="login",
-            Username=self.HNAP_AUTH["username"],
+            Username=auth["username"],
             LoginPassword=login_password,
             Captcha="",
         )
 
+    def _check_login_response(self, res):
         if res["LoginResult"] != "success":
             raise AuthenticationError(res["LoginResult"])
 
-        self._authenticated = time.monotonic()
+    def _parse_call_response(self, method, body):
+        if self._metrics is None:
+            resp = parse_response(body, method)
+        else:
+            started = time.perf_counter()
+            resp = parse_response(body, method)
+            self._metrics.phase(self, method, "parse", time.perf_counter() - started)
+
+        try:
+            res = resp[f"{method}Result"]
+        except (KeyError, TypeError):
+            raise MethodCallError(f"Missing {method}Result key")
+
+        if res and res.lower() in self.HNAP_INVALID_SESSION_RESULTS:
+            raise InvalidSessionError(f"{method} returned {res}")
+
+        if not res or res.lower() not in ("ok", "success"):
+            raise MethodCallError(f"{method} returned {res}")
+
+        return resp
 
     def is_authenticated(self):
         return (self._authenticated > 0) and (
             (time.monotonic() - self._authenticated) <= self._session_lifetime
         )
 
-    def _inspect_device(self, **kwargs):
+    @property
+    def _session_key(self):
+        return session_key(self.hostname, self.port, self.username)
+
+    def _restore_session(self):
+        if self._session_store is None:
+            return
+
+        try:
+            session = self._session_store.load(self._session_key)
+        except SessionStoreError as e:
+            _LOGGER.warning(f"{self.hostname}: unable to restore session: {e}")
+            return
+
+        if not session:
+            return
+
+        age = time.time() - session.get("authenticated_at", 0)
+        if not (0 <= age < self._session_lifetime):
+            return
+
+        for k in SESSION_KEYS:
+            self.HNAP_AUTH[k] = session.get(k, "")
+
+        self._authenticated = time.monotonic() - age
+        self._session_restored = True
+        self._used_since_login = False
+        _LOGGER.debug(f"{self.hostname}: session restored ({age:.0f}s old)")
+
+        self._schedule_renewal()
+
+    def _persist_session(self):
+        self._session_restored = False
+        if self._session_store is None:
+            return
+
+        session = {k: self.HNAP_AUTH[k] for k in SESSION_KEYS}
+        session["authenticated_at"] = time.time() - (
+            time.monotonic() - self._authenticated
+        )
+
+        try:
+            self._session_store.save(self._session_key, session)
+        except SessionStoreError as e:
+            _LOGGER.warning(f"{self.hostname}: unable to save session: {e}")
+
+    def _renewal_delay(self):
+        # Never renew more often than twice per session lifetime
+        renew_after = max(
+            self._session_lifetime - self._renew_margin, self._session_lifetime / 2
+        )
+        return max(0, self._authenticated + renew_after - time.monotonic())
+
+    def _needs_renewal(self, authenticated):
+        # Skip renewal if the session was replaced in the meantime or nobody
+        # used the client since the last login, let idle sessions expire.
+        return self._authenticated == authenticated and self._used_since_login
+
+    def _schedule_renewal(self):
+        pass
+
+    def _forget_session(self):
+        self._authenticated = 0
+        self._session_restored = False
+        if self._session_store is None:
+            return
+
+        try:
+            self._session_store.delete(self._session_key)
+        except SessionStoreError as e:
+            _LOGGER.warning(f"{self.hostname}: unable to delete session: {e}")
+
+    def _parse_device_settings(self, resp):
         def _unwrap_string_ordered_dict(data):
             ret = []
 
@@ -258,9 +518,7 @@ class SoapClient:
 
             return ret
 
-        info = dict(self.call("GetDeviceSettings", **kwargs))
-
-        # Rewrite some keys
+        info = dict(resp)
 
         # Rewrite some keys
         info["ModuleTypes"] = (
@@ -272,30 +530,424 @@ class SoapClient:
 
         return info
 
-    @auth_required
-    def device_info(self, **kwargs):
-        info = self._inspect_device(**kwargs)
-
+    def _device_info_from_settings(self, info):
+        info = dict(info)
         for k in ["@xmlns", "SOAPActions", "GetDeviceSettingsResult"]:
             info.pop(k, None)
 
         return info
 
-    @auth_required
-    def device_actions(self, **kwargs):
+    def _device_actions_from_settings(self, info):
         idx = len(self.HNAP1_XMLNS)
 
-        info = self._inspect_device(**kwargs)
         actions = info["SOAPActions"]
         actions = (x for x in actions if x.startswith(self.HNAP1_XMLNS))
         actions = (x[idx:] for x in actions)
 
         return list(actions)
 
+    def _parse_module_actions(self, resp):
+        return resp["ModuleSOAPList"]["SOAPActions"]["Action"]
+
+
+class SoapClient(BaseSoapClient):
+    def __init__(
+        self,
+        hostname,
+        password,
+        username=DEFAULT_USERNAME,
+        port=DEFAULT_PORT,
+        request_timeout=DEFAULT_REQUEST_TIMEOUT,
+        session_lifetime=DEFAULT_SESSION_LIFETIME,
+        session=None,
+        pool_size=DEFAULT_POOL_SIZE,
+        pool_idle_timeout=DEFAULT_POOL_IDLE_TIMEOUT,
+        session_store=None,
+        renew_margin=DEFAULT_SESSION_RENEW_MARGIN,
+        capability_cache=None,
+        coalesce=True,
+        metrics=None,
+        circuit_breaker=None,
+        retry=None,
+        timeouts=None,
+    ):
+        super().__init__(
+            hostname,
+            password,
+            username=username,
+            port=port,
+            request_timeout=request_timeout,
+            session_lifetime=session_lifetime,
+            session_store=session_store,
+            renew_margin=renew_margin,
+            capability_cache=capability_cache,
+            coalesce=coalesce,
+            metrics=metrics,
+            circuit_breaker=circuit_breaker,
+            retry=retry,
+            timeouts=timeouts,
+        )
+
+        # Sessions passed by the caller are shared, don't close or evict its
+        # connections, it's up to the owner
+        self._owns_session = session is None
+        self._session = session or self._build_session(pool_size)
+        self._pool_idle_timeout = pool_idle_timeout
+        self._last_request = 0.0
+        self._auth_lock = threading.Lock()
+
+        self._restore_session()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def session(self):
+        return self._session
+
+    @staticmethod
+    def _build_session(pool_size):
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size
+        )
+
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+
+        return session
+
+    def _evict_connections(self):
+        self._session.get_adapter(self.HNAP_AUTH["url"]).close()
+
+    def _request(self, method, data, headers):
+        # The breaker sees one outcome per logical request, retries included
+        breaker = self._circuit_breaker
+        probe = breaker is not None and breaker.acquire()
+        timeout = self._request_timeouts(method, probe)
+
+        success = False
+        try:
+            resp = self._request_with_retry(method, data, headers, timeout, probe)
+            success = resp.status_code < 500
+            return resp
+
+        finally:
+            if breaker is not None:
+                breaker.record(success, probe)
+
+    def _request_with_retry(self, method, data, headers, timeout, probe=False):
+        if self._retry is None or probe:
+            return self._timed_request(method, data, headers, timeout)
+
+        delays = self._retry.delays()
+        while True:
+            try:
+                return self._timed_request(method, data, headers, timeout)
+
+            except requests.ConnectionError as e:
+                delay = next(delays, None)
+                if delay is None or not self._is_retryable(method, e):
+                    raise
+
+                _LOGGER.debug(f"{self.hostname}: {e}, retrying in {delay:.2f}s")
+                time.sleep(delay)
+
+    def _is_retryable(self, method, error):
+        # ConnectTimeout is a ConnectionError too, timeouts are never retried
+        if isinstance(error, requests.Timeout):
+            return False
+
+        return _connect_failed(error) or _is_read_only(method)
+
+    def _timed_request(self, method, data, headers, timeout):
+        started = time.perf_counter()
+        try:
+            resp = self._send(method, data, headers, timeout)
+
+        except requests.Timeout:
+            self._timeouts.timed_out(method)
+            raise
+
+        self._timeouts.observe(method, time.perf_counter() - started)
+        return resp
+
+    def _send(self, method, data, headers, timeout):
+        url = self.HNAP_AUTH["url"]
+
+        reused = self._last_request > 0
+        if (
+            reused
+            and self._owns_session
+            and self._pool_idle_timeout
+            and (time.monotonic() - self._last_request) > self._pool_idle_timeout
+        ):
+            # Devices drop idle keep-alive sockets quite fast, don't bother
+            # with them
+            self._evict_connections()
+            reused = False
+
+        def _do_request():
+            return self._session.request(
+                method=self.HNAP_METHOD,
+                url=url,
+                headers=headers,
+                data=data,
+                timeout=timeout,
+            )
+
+        try:
+            resp = _do_request()
+
+        except requests.Timeout:
+            raise
+
+        except requests.ConnectionError as e:
+            # A refused connection is not a stale one. The request may have
+            # reached the device before the connection was closed, only send
+            # it again if that's harmless.
+            if not reused or _connect_failed(e) or not self._is_retryable(method, e):
+                raise
+
+            # Device closed a kept-alive connection under our feet, retry
+            # once with a fresh one. Shared pools are left alone, urllib3
+            # replaces the dead connection by itself
+            _LOGGER.debug(f"{self.hostname}: stale connection, reconnecting")
+            self._connection_used("stale")
+            if self._owns_session:
+                self._evict_connections()
+            reused = False
+            resp = _do_request()
+
+        self._connection_used("reused" if reused else "new")
+        self._last_request = time.monotonic()
+        return resp
+
+    def close(self):
+        if self._owns_session:
+            self._session.close()
+
+        self._last_request = 0.0
+
+    def _call_request(self, method, parameters, auth=None):
+        data, headers = self._build_call_request(method, parameters, auth=auth)
+
+        if self._metrics is None:
+            resp = self._request(method, data, headers)
+        else:
+            started = time.perf_counter()
+            resp = self._request(method, data, headers)
+            self._metrics.phase(self, method, "http", time.perf_counter() - started)
+            self._metrics.transferred(self, method, len(data), len(resp.content))
+
+        if resp.status_code in self.HNAP_INVALID_SESSION_STATUS_CODES:
+            raise InvalidSessionError(
+                f"Invalid status code: {resp.status_code}", resp.status_code
+            )
+
+        if resp.status_code != 200:
+            raise MethodCallError(
+                f"Invalid status code: {resp.status_code}", resp.status_code
+            )
+        return resp
+
+    def _call(self, method, parameters, auth=None):
+        resp = self._call_request(method, parameters, auth=auth)
+        return self._parse_call_response(method, resp.content)
+
+    def _call_with_reauth(self, fn, method, parameters):
+        self._used_since_login = True
+        auth = self.HNAP_AUTH
+
+        try:
+            ret = fn(method, parameters, auth=auth)
+
+        except MethodCallError as e:
+            # Restored sessions are not trusted until the first successful call
+            if not self._session_restored and not isinstance(e, InvalidSessionError):
+                raise
+
+            _LOGGER.debug(f"{self.hostname}: session rejected ({e})")
+            self._reauthenticate(auth)
+            return fn(method, parameters)
+
+        self._session_restored = False
+        return ret
+
+    def _call_with_metrics(self, fn, method, parameters):
+        metrics = self._metrics
+        if metrics is None:
+            return self._call_with_reauth(fn, method, parameters)
+
+        metrics.call_started(self, method)
+        started = time.perf_counter()
+        error = None
+        try:
+            return self._call_with_reauth(fn, method, parameters)
+
+        except Exception as e:
+            error = e
+            raise
+
+        finally:
+            metrics.call_finished(self, method, time.perf_counter() - started, error)
+
+    def call_raw(self, method, **parameters):
+        resp = self._call_with_metrics(self._call_request, method, parameters)
+        return resp.text
+
+    def call(self, method, **parameters):
+        key = self._coalesce_key(method, parameters)
+        if key is None:
+            return self._call_with_metrics(self._call, method, parameters)
+
+        # Identical concurrent calls share the request, each caller gets its
+        # own copy of the result
+        return _SINGLE_FLIGHT.do(
+            key, lambda: self._call_with_metrics(self._call, method, parameters)
+        )
+
     @auth_required
+    def call_many(self, calls):
+        # Requests run back to back over the same kept-alive connection.
+        # Method errors are returned in place, transport errors are assigned
+        # to the remaining calls too: there is no point on waiting for a
+        # timeout on each one.
+        calls = list(calls)
+        ret = []
+
+        for idx, (method, parameters) in enumerate(calls):
+            try:
+                ret.append(self.call(method, **parameters))
+
+            except ClientError as e:
+                ret.append(e)
+
+            except requests.RequestException as e:
+                ret.extend([e] * (len(calls) - idx))
+                break
+
+        return ret
+
+    def authenticate(self, force=False):
+        if self.is_authenticated() and not force:
+            _LOGGER.debug("Client already authenticated")
+            return
+
+        # Only one login runs at a time, threads waiting here reuse the
+        # session obtained by the first one
+        auth = self.HNAP_AUTH
+        with self._auth_lock:
+            if self.is_authenticated() and (not force or self.HNAP_AUTH is not auth):
+                return
+
+            self._login("renewal" if self._authenticated else "login")
+
+    def _reauthenticate(self, stale_auth):
+        with self._auth_lock:
+            # Session was replaced while the request was in flight
+            if self.HNAP_AUTH is not stale_auth:
+                return
+
+            self._forget_session()
+            self._login("relogin")
+
+    def _login(self, reason):
+        metrics = self._metrics
+        if metrics is None:
+            return self._do_login()
+
+        started = time.perf_counter()
+        error = None
+        try:
+            self._do_login()
+
+        except Exception as e:
+            error = e
+            raise
+
+        finally:
+            metrics.login(self, reason, time.perf_counter() - started, error)
+
+    def _do_login(self):
+        data, headers = self._build_login_request()
+        resp = self._request(self.HNAP_LOGIN_METHOD, data, headers)
+
+        if resp.status_code != 200:
+            raise AuthenticationError(
+                f"Invalid response while login: {resp.status_code} ({resp.text})"
+            )
+
+        # Build the new session aside and swap it when complete, requests
+        # in flight keep using the old one
+        auth = self.HNAP_AUTH.copy()
+        self._save_login_result(resp.content, auth)
+
+        # Phase 2
+        res = self._call(
+            self.HNAP_LOGIN_METHOD, self._build_login_parameters(auth), auth=auth
+        )
+        self._check_login_response(res)
+
+        self.HNAP_AUTH = auth
+        self._authenticated = time.monotonic()
+        self._used_since_login = False
+        self._persist_session()
+        self._schedule_renewal()
+
+    def _schedule_renewal(self):
+        if self._renew_margin is not None:
+            _RENEWER.schedule(self, self._renewal_delay())
+
+    def _renew_session(self, authenticated):
+        if not self._needs_renewal(authenticated):
+            return
+
+        _LOGGER.debug(f"{self.hostname}: renewing session")
+        try:
+            self.authenticate(force=True)
+        except (ClientError, requests.RequestException) as e:
+            _LOGGER.warning(f"{self.hostname}: unable to renew session: {e}")
+
+    @auth_required
+    def _fetch_device_settings(self, **kwargs):
+        return self._parse_device_settings(self.call("GetDeviceSettings", **kwargs))
+
+    def _inspect_device(self, **kwargs):
+        if kwargs:
+            return self._fetch_device_settings(**kwargs)
+
+        info = self._capabilities.get_settings(self._capability_key)
+        if info is None:
+            info = self._fetch_device_settings()
+            self._capabilities.set_settings(self._capability_key, info)
+
+        return info
+
+    def device_info(self, **kwargs):
+        return self._device_info_from_settings(self._inspect_device(**kwargs))
+
+    def device_actions(self, **kwargs):
+        return self._device_actions_from_settings(self._inspect_device(**kwargs))
+
+    @auth_required
+    def _fetch_module_actions(self, **kwargs):
+        resp = self.call("GetModuleSOAPActions", **kwargs)
+        return self._parse_module_actions(resp)
+
     def module_actions(self, *, ModuleID=DEFAULT_MODULE_ID, **kwargs):
-        resp = self.call("GetModuleSOAPActions", ModuleID=ModuleID, **kwargs)
-        actions = resp["ModuleSOAPList"]["SOAPActions"]["Action"]
+        if kwargs:
+            return self._fetch_module_actions(ModuleID=ModuleID, **kwargs)
+
+        actions = self._capabilities.get_module_actions(self._capability_key, ModuleID)
+        if actions is None:
+            actions = self._fetch_module_actions(ModuleID=ModuleID)
+            self._capabilities.set_module_actions(
+                self._capability_key, ModuleID, actions
+            )
 
         return actions
 
@@ -310,3 +962,11 @@ class AuthenticationError(ClientError):
 
 class MethodCallError(ClientError):
     pass
+
+
+class InvalidSessionError(MethodCallError):
+    pass
+
+
+class CircuitOpenError(ClientError):
+    pass
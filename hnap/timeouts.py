@@ -0,0 +1,146 @@
+#
+# Copyright (C) 2021 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import threading
+
+from .const import (
+    DEFAULT_ADAPTIVE_CONNECT_TIMEOUT,
+    DEFAULT_ADAPTIVE_CONNECT_TIMEOUT_MIN,
+    DEFAULT_ADAPTIVE_TIMEOUT_FACTOR,
+    DEFAULT_ADAPTIVE_TIMEOUT_MIN,
+    DEFAULT_ADAPTIVE_TIMEOUT_WARMUP,
+    DEFAULT_REQUEST_TIMEOUT,
+)
+
+
+class Timeouts:
+    # Connect and read timeouts, in seconds. methods overrides the read
+    # timeout for slow actions, ex. {"Login": 20}.
+
+    def __init__(
+        self,
+        connect=DEFAULT_REQUEST_TIMEOUT,
+        read=DEFAULT_REQUEST_TIMEOUT,
+        methods=None,
+    ):
+        self.connect = connect
+        self.read = read
+        self.methods = dict(methods or {})
+
+    def get(self, method):
+        return self.connect, self.methods.get(method, self.read)
+
+    def observe(self, method, elapsed):
+        pass
+
+    def timed_out(self, method):
+        pass
+
+
+class _Estimate:
+    def __init__(self):
+        self.samples = 0
+        self.srtt = 0.0
+        self.rttvar = 0.0
+        self.backoff = 1
+
+
+class AdaptiveTimeouts(Timeouts):
+    # Read timeouts follow the response times observed for each method, like
+    # TCP retransmission timeouts (RFC 6298):
+    #
+    #   max(factor * (srtt + 4 * rttvar), min_timeout) * backoff
+    #
+    # bounded by the static timeout for the method. Methods with less than
+    # warmup samples use the static one. Each timeout doubles backoff until
+    # the next response so a device that turns slow is not starved.
+    #
+    # The connect timeout uses the same formula over every response from the
+    # device, with its own floor (min_connect_timeout). A connection can't
+    # take longer than a whole response did, so dead devices are detected in
+    # a fraction of a second. Until then the static connect timeout applies,
+    # it defaults to a couple of seconds instead of the request timeout.
+
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+
+    def __init__(
+        self,
+        connect=DEFAULT_ADAPTIVE_CONNECT_TIMEOUT,
+        read=DEFAULT_REQUEST_TIMEOUT,
+        methods=None,
+        min_timeout=DEFAULT_ADAPTIVE_TIMEOUT_MIN,
+        min_connect_timeout=DEFAULT_ADAPTIVE_CONNECT_TIMEOUT_MIN,
+        factor=DEFAULT_ADAPTIVE_TIMEOUT_FACTOR,
+        warmup=DEFAULT_ADAPTIVE_TIMEOUT_WARMUP,
+    ):
+        super().__init__(connect=connect, read=read, methods=methods)
+        self.min_timeout = min_timeout
+        self.min_connect_timeout = min_connect_timeout
+        self.factor = factor
+        self.warmup = warmup
+
+        self._estimates = {}
+        self._device = _Estimate()
+        self._lock = threading.Lock()
+
+    def _timeout(self, estimate, min_timeout, max_timeout):
+        if estimate is None or estimate.samples < self.warmup:
+            return max_timeout
+
+        timeout = max(self.factor * (estimate.srtt + 4 * estimate.rttvar), min_timeout)
+        return min(timeout * estimate.backoff, max_timeout)
+
+    def get(self, method):
+        connect, read = super().get(method)
+
+        return (
+            self._timeout(self._device, self.min_connect_timeout, connect),
+            self._timeout(self._estimates.get(method), self.min_timeout, read),
+        )
+
+    def _update(self, estimate, elapsed):
+        if estimate.samples == 0:
+            estimate.srtt = elapsed
+            estimate.rttvar = elapsed / 2
+        else:
+            estimate.rttvar += self.BETA * (
+                abs(estimate.srtt - elapsed) - estimate.rttvar
+            )
+            estimate.srtt += self.ALPHA * (elapsed - estimate.srtt)
+
+        estimate.samples += 1
+        estimate.backoff = 1
+
+    def observe(self, method, elapsed):
+        with self._lock:
+            estimate = self._estimates.get(method)
+            if estimate is None:
+                estimate = self._estimates[method] = _Estimate()
+
+            self._update(estimate, elapsed)
+            self._update(self._device, elapsed)
+
+    def timed_out(self, method):
+        with self._lock:
+            estimate = self._estimates.get(method)
+            if estimate is not None:
+                estimate.backoff = min(estimate.backoff * 2, 64)
+
+            self._device.backoff = min(self._device.backoff * 2, 64)